@@ -1,24 +1,126 @@
 import prisma from '../../prisma/client';
 import { Request, Response } from 'express';
 
+// Maps the public column names onto the precomputed leaderboard metrics
+const leaderboardMetrics: Record<string, string> = {
+  current_price: 'price',
+  price_change: 'dollar',
+  percentage_change: 'pct',
+};
+const leaderboardTimeframes = ['7d', '30d', '6m', 'ytd', '1y', 'all'];
+
 export const getTopOrBottomCards = async (req: Request, res: Response) => {
   try {
-    const { sort = 'desc', column = 'current_price' } = req.query;
+    const { sort = 'desc', column = 'current_price', timeframe = '7d', sub_type = 'all' } = req.query;
     
-    // Validate allowed columns for security
-    const allowedColumns = ['current_price', 'price_change', 'percentage_change', 'productId'];
-    const sortColumn = allowedColumns.includes(column as string) ? column as string : 'current_price';
-    const sortOrder = sort === 'asc' ? 'asc' : 'desc';
-
-    const cards = await prisma.price_change.findMany({
-      orderBy: {
-        [sortColumn]: sortOrder,
+    // Validate allowed values for security
+    const requestedColumn = column as string;
+    const sortColumn = requestedColumn in leaderboardMetrics ? requestedColumn : 'current_price';
+    const metric = leaderboardMetrics[sortColumn];
+    const direction = sort === 'asc' ? 'bottom' : 'top';
+    const period = metric === 'price'
+      ? 'current'
+      : leaderboardTimeframes.includes(timeframe as string) ? timeframe as string : '7d';
+
+    // Leaderboards are ranked by the price_changes ETL, so this is a primary key range read
+    const ranked = await prisma.price_change_leaderboard.findMany({
+      where: {
+        timeframe: period,
+        metric,
+        sub_type_name: sub_type as string,
+        direction,
       },
+      orderBy: { rank: 'asc' },
       take: 15,
     });
 
+    // price_change has one row per variant, so match on product and sub-type
+    const rows = await prisma.price_change.findMany({
+      where: {
+        OR: ranked.map((entry) => ({
+          product_id: entry.product_id,
+          sub_type_name: entry.variant_sub_type_name,
+        })),
+      },
+    });
+    const variantKey = (productId: number, subType: string) => `${productId}:${subType}`;
+    const byVariant = new Map(rows.map((row) => [variantKey(row.product_id, row.sub_type_name), row]));
+
+    const cards = ranked
+      .map((entry) => byVariant.get(variantKey(entry.product_id, entry.variant_sub_type_name)))
+      .filter((row) => row !== undefined);
+
     res.json(cards);
   } catch (error) {
     res.status(500).json({ error: 'Failed to fetch cards' });
   }
-};
\ No newline at end of file
+};
+
+type CardSearchResult = {
+  product_id: number;
+  name: string;
+  clean_name: string;
+  group_id: number | null;
+  image_url: string | null;
+  ext_number: string | null;
+  ext_rarity: string | null;
+  score: number;
+};
+
+export const searchCards = async (req: Request, res: Response) => {
+  try {
+    const query = ((req.query.q as string) || '').trim();
+    const limit = Math.min(Math.max(parseInt(req.query.limit as string, 10) || 20, 1), 100);
+    if (!query) {
+      res.status(400).json({ error: 'Missing search query' });
+      return;
+    }
+
+    // Ranked full-text match on the weighted search_vector (GIN index)
+    let cards = await prisma.$queryRaw<CardSearchResult[]>`
+      SELECT product_id, name, clean_name, group_id, image_url, ext_number, ext_rarity,
+             ts_rank(search_vector, websearch_to_tsquery('english', ${query})) AS score
+      FROM products
+      WHERE search_vector @@ websearch_to_tsquery('english', ${query})
+      ORDER BY score DESC, product_id
+      LIMIT ${limit}
+    `;
+
+    // Fall back to fuzzy name matching (trigram index) for typos and partial names
+    if (cards.length === 0) {
+      cards = await prisma.$queryRaw<CardSearchResult[]>`
+        SELECT product_id, name, clean_name, group_id, image_url, ext_number, ext_rarity,
+               similarity(name, ${query}) AS score
+        FROM products
+        WHERE name % ${query} OR name ILIKE ${'%' + query + '%'}
+        ORDER BY score DESC, product_id
+        LIMIT ${limit}
+      `;
+    }
+
+    res.json(cards);
+  } catch (error) {
+    res.status(500).json({ error: 'Failed to search cards' });
+  }
+};
+
+export const getRecommendations = async (req: Request, res: Response) => {
+  try {
+    const after = Math.max(parseInt(req.query.after as string, 10) || 0, 0);
+    const limit = Math.min(Math.max(parseInt(req.query.limit as string, 10) || 20, 1), 100);
+
+    // Keyset pagination on the unique rank index: every page is an index range read
+    const cards = await prisma.investment_scores.findMany({
+      where: { rank: { gt: after } },
+      orderBy: { rank: 'asc' },
+      take: limit,
+    });
+
+    res.json({
+      cards,
+      next: cards.length === limit ? cards[cards.length - 1].rank : null,
+    });
+  } catch (error) {
+    res.status(500).json({ error: 'Failed to fetch recommendations' });
+  }
+};
@@ -1,8 +1,10 @@
 import { Router } from 'express';
-import { getTopOrBottomCards } from '../controllers/cardController';
+import { getRecommendations, getTopOrBottomCards, searchCards } from '../controllers/cardController';
 
 const router = Router();
 
 router.get('/price_change/top-bottom', getTopOrBottomCards);
+router.get('/cards/search', searchCards);
+router.get('/recommendations', getRecommendations);
 
 export default router;
\ No newline at end of file
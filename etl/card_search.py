@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""Full-text and fuzzy search structures on the products table.
+
+products.search_vector is a weighted tsvector (A: names, B: number, rarity,
+card type and stage, C: attacks, D: card text) behind a GIN index, and the
+name columns get pg_trgm indexes so ILIKE and similarity() lookups no longer
+scan the table. The daily ETL recomputes the vector inside its products
+upsert, only for new rows and rows whose searchable text changed. Running
+this file backfills rows whose vector is missing or stale.
+"""
+
+import psycopg2
+import logging
+from datetime import datetime
+import os
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Database connection parameters
+DB_PARAMS = {
+    "host": os.getenv("DB_HOST", "localhost"),
+    "database": os.getenv("DB_NAME", "pokemon_tcg"),
+    "user": os.getenv("DB_USER", "postgres"),
+    "password": os.getenv("DB_PASSWORD", ""),
+    "port": os.getenv("DB_PORT", "5432")
+}
+
+# Text search configuration used for both the stored vectors and queries
+SEARCH_CONFIG = "english"
+PRODUCT_BATCH_SIZE = 5000
+
+# Columns that feed search_vector; a change to any of them triggers a recompute
+SEARCH_COLUMNS = (
+    "name", "clean_name", "ext_number", "ext_rarity", "ext_card_type", "ext_stage",
+    "ext_attack1", "ext_attack2", "ext_attack3", "ext_attack4", "ext_card_text",
+)
+
+def search_vector_sql(alias):
+    """SQL expression building the weighted search vector from the columns of alias"""
+    def doc(*columns):
+        return f"to_tsvector('{SEARCH_CONFIG}', concat_ws(' ', {', '.join(f'{alias}.{c}' for c in columns)}))"
+
+    return (
+        f"setweight({doc('name', 'clean_name')}, 'A') || "
+        f"setweight({doc('ext_number', 'ext_rarity', 'ext_card_type', 'ext_stage')}, 'B') || "
+        f"setweight({doc('ext_attack1', 'ext_attack2', 'ext_attack3', 'ext_attack4')}, 'C') || "
+        f"setweight({doc('ext_card_text')}, 'D')"
+    )
+
+def search_columns_changed_sql(old, new):
+    """SQL condition that is true when any searchable column differs between old and new"""
+    return (
+        f"({', '.join(f'{old}.{c}' for c in SEARCH_COLUMNS)}) IS DISTINCT FROM "
+        f"({', '.join(f'{new}.{c}' for c in SEARCH_COLUMNS)})"
+    )
+
+def ensure_search_index(conn):
+    """Add products.search_vector and the search indexes if they are missing.
+
+    Returns True when the column was just added, in which case it is backfilled
+    before returning. Trigram indexes are skipped with a warning when the
+    pg_trgm extension cannot be installed.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT 1 FROM information_schema.columns
+            WHERE table_name = 'products' AND column_name = 'search_vector'
+        """)
+        created = cursor.fetchone() is None
+
+        cursor.execute("ALTER TABLE products ADD COLUMN IF NOT EXISTS search_vector tsvector")
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_products_search_vector
+            ON products USING GIN (search_vector)
+        """)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logging.error(f"Error creating products search_vector: {e}")
+        raise
+    finally:
+        cursor.close()
+
+    cursor = conn.cursor()
+    try:
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_products_name_trgm
+            ON products USING GIN (name gin_trgm_ops)
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_products_clean_name_trgm
+            ON products USING GIN (clean_name gin_trgm_ops)
+        """)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logging.warning(f"Skipping trigram indexes on products: {e}")
+    finally:
+        cursor.close()
+
+    if created:
+        logging.info("Added products.search_vector")
+        backfill_search_vectors(conn)
+    return created
+
+def backfill_search_vectors(conn):
+    """Recompute search_vector where it is missing or out of date.
+
+    Works through products one product_id range per transaction and only
+    writes rows whose stored vector differs, so rerunning it is cheap.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT MIN(product_id), MAX(product_id) FROM products")
+        min_id, max_id = cursor.fetchone()
+    finally:
+        cursor.close()
+
+    if min_id is None:
+        return 0
+
+    total_updated = 0
+    for first_id in range(min_id, max_id + 1, PRODUCT_BATCH_SIZE):
+        last_id = first_id + PRODUCT_BATCH_SIZE - 1
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f"""
+                UPDATE products p
+                SET search_vector = {search_vector_sql('p')}
+                WHERE p.product_id BETWEEN %s AND %s
+                  AND p.search_vector IS DISTINCT FROM ({search_vector_sql('p')})
+            """, (first_id, last_id))
+            total_updated += cursor.rowcount
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            logging.error(f"Error backfilling search vectors for products {first_id}-{last_id}: {e}")
+        finally:
+            cursor.close()
+
+    logging.info(f"Backfilled search vectors for {total_updated} products")
+    return total_updated
+
+def main():
+    """Create the search structures and backfill any missing or stale vectors"""
+    logging.info("Starting card search backfill")
+    start_time = datetime.now()
+
+    try:
+        conn = psycopg2.connect(**DB_PARAMS)
+        if not ensure_search_index(conn):
+            backfill_search_vectors(conn)
+        conn.close()
+
+        duration = (datetime.now() - start_time).total_seconds()
+        logging.info(f"Card search backfill completed in {duration:.2f} seconds")
+
+    except Exception as e:
+        logging.error(f"Card search backfill failed: {e}")
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] %(message)s",
+        handlers=[
+            logging.FileHandler("card_search.log"),
+            logging.StreamHandler()
+        ]
+    )
+    main()
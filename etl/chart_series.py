@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+
+import psycopg2
+from psycopg2.extras import execute_values
+import numpy as np
+import logging
+import os
+import time
+from dotenv import load_dotenv
+
+from history_frame import load_price_history
+from price_snapshot import ensure_snapshot_table
+
+# Load environment variables
+load_dotenv()
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+    handlers=[
+        logging.FileHandler("chart_series.log"),
+        logging.StreamHandler()
+    ]
+)
+
+# Database connection parameters
+DB_PARAMS = {
+    "host": os.getenv("DB_HOST", "localhost"),
+    "database": os.getenv("DB_NAME", "pokemon_tcg"),
+    "user": os.getenv("DB_USER", "postgres"),
+    "password": os.getenv("DB_PASSWORD", ""),
+    "port": os.getenv("DB_PORT", "5432")
+}
+
+# Points per series: 30 for grid sparklines (mini-chart), 200 for the detail chart.
+# Each series is stored as first_date plus day offsets and prices, which keeps a
+# 200 point series to a couple of kilobytes.
+RESOLUTIONS = [int(r) for r in os.getenv("CHART_RESOLUTIONS", "30,200").split(",")]
+PRODUCT_BATCH_SIZE = 2000
+
+def ensure_chart_series_table(conn):
+    """Create the chart_series table if it does not exist yet"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS chart_series (
+                product_id     INTEGER      NOT NULL,
+                sub_type_name  VARCHAR(100) NOT NULL,
+                resolution     SMALLINT     NOT NULL,
+                first_date     DATE         NOT NULL,
+                last_date      DATE         NOT NULL,
+                day_offsets    INTEGER[]    NOT NULL,
+                prices         REAL[]       NOT NULL,
+                updated_at     TIMESTAMP(6) NOT NULL DEFAULT now(),
+                PRIMARY KEY (product_id, sub_type_name, resolution)
+            )
+        """)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logging.error(f"Error creating chart_series table: {e}")
+        raise
+    finally:
+        cursor.close()
+
+def lttb(x, y, threshold):
+    """Largest-Triangle-Three-Buckets downsampling, returns the indices to keep.
+
+    x and y are (series x points) arrays holding equal-length series, so all
+    series of one length are downsampled together and the Python loop only runs
+    once per bucket. The first and last point are always kept; every other
+    bucket contributes the point forming the largest triangle with the
+    previously kept point and the average of the next bucket, which preserves
+    spikes and trend changes.
+    """
+    x = np.atleast_2d(x)
+    y = np.atleast_2d(y)
+    m, n = x.shape
+    if threshold >= n or threshold < 3:
+        return np.tile(np.arange(n), (m, 1))
+
+    keep = np.empty((m, threshold), dtype=np.int64)
+    keep[:, 0] = 0
+    keep[:, -1] = n - 1
+
+    # Bucket boundaries for the n - 2 interior points
+    edges = np.floor(np.linspace(1, n - 1, threshold - 1)).astype(np.int64)
+
+    rows = np.arange(m)
+    a = np.zeros(m, dtype=np.int64)
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[:, end:next_end].mean(axis=1)
+        avg_y = y[:, end:next_end].mean(axis=1)
+        ax = x[rows, a][:, None]
+        ay = y[rows, a][:, None]
+
+        # Twice the triangle area; the constant factor does not change the argmax
+        area = np.abs(
+            (ax - avg_x[:, None]) * (y[:, start:end] - ay)
+            - (ax - x[:, start:end]) * (avg_y[:, None] - ay)
+        )
+        a = start + area.argmax(axis=1)
+        keep[:, i + 1] = a
+
+    return keep
+
+def get_stale_variants(conn, resolution):
+    """Find variants loaded since their stored series ended, with their latest load date.
+
+    A series ends at price_snapshot.latest_date (see build_series), so this is
+    one refresh per load in either storage mode.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT ps.product_id, ps.sub_type_name, ps.latest_date
+            FROM price_snapshot ps
+            LEFT JOIN chart_series cs
+              ON cs.product_id = ps.product_id
+             AND cs.sub_type_name = ps.sub_type_name
+             AND cs.resolution = %s
+            WHERE cs.last_date IS NULL OR ps.latest_date > cs.last_date
+        """, (resolution,))
+        return cursor.fetchall()
+    except Exception as e:
+        logging.error(f"Error finding stale chart series: {e}")
+        return []
+    finally:
+        cursor.close()
+
+def build_series(history, stale_latest, resolutions):
+    """Downsample every stale variant in a history frame at each resolution.
+
+    stale_latest maps (product_id, sub_type_name) to the variant's latest_date.
+    Each series is first forward filled to one point per day up to that date,
+    since a row is in effect until the next one: a change-only history then
+    plots as steps that reach the last load, not ramps that stop at the last
+    change.
+    """
+    history = history.dropna(subset=["market_price"])
+    if history.empty:
+        return []
+
+    sub_type_column = history["sub_type_name"].astype("category")
+    sub_type_names = np.asarray(sub_type_column.cat.categories, dtype=object)
+    sub_type_codes = sub_type_column.cat.codes.values
+    product_ids = history["product_id"].values
+    days = history["date_point"].values.astype("datetime64[D]").astype(np.int64)
+
+    # One packed int64 key sorts several times faster than a three-key lexsort
+    day_span = int(days.max() - days.min()) + 1
+    sort_key = (product_ids.astype(np.int64) * len(sub_type_names) + sub_type_codes) * day_span + (days - days.min())
+    order = np.argsort(sort_key)
+    product_ids = product_ids[order]
+    sub_type_codes = sub_type_codes[order]
+    days = days[order]
+    prices = history["market_price"].values[order].astype(np.float64)
+
+    # Contiguous runs of the sorted arrays are the individual series
+    new_series = np.ones(len(order), dtype=bool)
+    new_series[1:] = (product_ids[1:] != product_ids[:-1]) | (sub_type_codes[1:] != sub_type_codes[:-1])
+    starts = np.flatnonzero(new_series)
+    lengths = np.diff(np.append(starts, len(order)))
+    sub_types = sub_type_names[sub_type_codes[starts]]
+    starts_product_ids = product_ids[starts]
+
+    # Batches are loaded per product, so drop sibling variants that are still fresh
+    stale = np.array([(int(p), st) in stale_latest for p, st in zip(starts_product_ids, sub_types)], dtype=bool)
+    if not stale.any():
+        return []
+    stale_rows = np.repeat(stale, lengths)
+    days = days[stale_rows]
+    prices = prices[stale_rows]
+    sub_types = sub_types[stale]
+    starts_product_ids = starts_product_ids[stale]
+    lengths = lengths[stale]
+    starts = np.cumsum(lengths) - lengths
+
+    # Each row covers the days up to the next row of its series; the last row
+    # runs to the variant's latest_date
+    ends = starts + lengths - 1
+    latest = np.array([
+        np.datetime64(stale_latest[(int(p), st)], "D").astype(np.int64)
+        for p, st in zip(starts_product_ids, sub_types)
+    ])
+    coverage = np.diff(np.append(days, 0))
+    coverage[ends] = np.maximum(latest, days[ends]) - days[ends] + 1
+    lengths = np.add.reduceat(coverage, starts)
+    starts = np.cumsum(lengths) - lengths
+    row_starts = np.cumsum(coverage) - coverage
+    days = np.repeat(days, coverage) + (np.arange(int(coverage.sum())) - np.repeat(row_starts, coverage))
+    prices = np.repeat(prices, coverage)
+
+    epoch = np.datetime64("1970-01-01", "D")
+    rows = []
+    for length in np.unique(lengths):
+        same_length = lengths == length
+        series_starts = starts[same_length]
+        series_product_ids = starts_product_ids[same_length]
+        series_sub_types = sub_types[same_length]
+        positions = series_starts[:, None] + np.arange(length)
+        x = days[positions]
+        y = prices[positions]
+
+        for resolution in resolutions:
+            keep = lttb(x.astype(np.float64), y, resolution)
+            kept_days = np.take_along_axis(x, keep, axis=1)
+            kept_prices = np.round(np.take_along_axis(y, keep, axis=1), 2)
+
+            for j in range(len(series_starts)):
+                first_day = kept_days[j, 0]
+                rows.append((
+                    int(series_product_ids[j]), series_sub_types[j], resolution,
+                    (epoch + first_day).item(), (epoch + kept_days[j, -1]).item(),
+                    (kept_days[j] - first_day).tolist(), kept_prices[j].tolist(),
+                ))
+
+    return rows
+
+def store_series(conn, rows):
+    """Upsert downsampled series"""
+    if not rows:
+        return 0
+
+    cursor = conn.cursor()
+    try:
+        execute_values(cursor, """
+            INSERT INTO chart_series (
+                product_id, sub_type_name, resolution, first_date, last_date, day_offsets, prices
+            )
+            VALUES %s
+            ON CONFLICT (product_id, sub_type_name, resolution) DO UPDATE SET
+                first_date = EXCLUDED.first_date,
+                last_date = EXCLUDED.last_date,
+                day_offsets = EXCLUDED.day_offsets,
+                prices = EXCLUDED.prices,
+                updated_at = now()
+        """, rows, template="(%s, %s, %s, %s, %s, %s::integer[], %s::real[])", page_size=500)
+        conn.commit()
+        return len(rows)
+    except Exception as e:
+        conn.rollback()
+        logging.error(f"Error storing chart series: {e}")
+        return 0
+    finally:
+        cursor.close()
+
+def main():
+    """Refresh downsampled chart series for every variant with new prices"""
+    logging.info("Starting chart series refresh")
+    start_time = time.time()
+
+    try:
+        conn = psycopg2.connect(**DB_PARAMS)
+        ensure_snapshot_table(conn)
+        ensure_chart_series_table(conn)
+
+        # A variant is refreshed at every resolution once any of them is stale
+        stale = {}
+        for resolution in RESOLUTIONS:
+            stale.update(((product_id, sub_type_name), latest_date)
+                         for product_id, sub_type_name, latest_date in get_stale_variants(conn, resolution))
+        logging.info(f"Found {len(stale)} variants with new prices")
+
+        product_ids = sorted({product_id for product_id, _ in stale})
+        total_stored = 0
+        for offset in range(0, len(product_ids), PRODUCT_BATCH_SIZE):
+            batch_start = time.time()
+            batch_ids = product_ids[offset:offset + PRODUCT_BATCH_SIZE]
+
+            history = load_price_history(conn, columns=["market_price"], product_ids=batch_ids)
+            rows = build_series(history, stale, RESOLUTIONS)
+            total_stored += store_series(conn, rows)
+
+            logging.info(f"Batch {offset // PRODUCT_BATCH_SIZE + 1}: stored {len(rows)} series for {len(batch_ids)} products in {time.time() - batch_start:.2f} seconds")
+
+        conn.close()
+
+        duration = time.time() - start_time
+        logging.info(f"Chart series refresh completed in {duration:.2f} seconds, stored {total_stored} series")
+
+    except Exception as e:
+        logging.error(f"Chart series refresh failed: {e}")
+
+if __name__ == "__main__":
+    main()
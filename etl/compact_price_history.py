@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""One-time conversion of a full daily price_history into change-only rows.
+
+A variant's first row is always kept, and every later row that repeats the
+previous one is deleted, so each remaining row is in effect until the next.
+Readers that follow the semantics in price_storage (get_prices_as_of,
+history_frame.pivot_daily with an unlimited fill) give the same prices
+before and after compaction; only the row dates reported with them move back
+to the day each price was first recorded.
+"""
+
+import psycopg2
+import argparse
+import logging
+from datetime import datetime
+import os
+from dotenv import load_dotenv
+
+from price_storage import NOT_QUARANTINED_SQL, STORAGE_MODE
+
+# Load environment variables
+load_dotenv()
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+    handlers=[
+        logging.FileHandler("compact_price_history.log"),
+        logging.StreamHandler()
+    ]
+)
+
+# Database connection parameters
+DB_PARAMS = {
+    "host": os.getenv("DB_HOST", "localhost"),
+    "database": os.getenv("DB_NAME", "pokemon_tcg"),
+    "user": os.getenv("DB_USER", "postgres"),
+    "password": os.getenv("DB_PASSWORD", ""),
+    "port": os.getenv("DB_PORT", "5432")
+}
+
+PRODUCT_BATCH_SIZE = 2000
+
+def get_product_id_bounds(conn):
+    """Get the smallest and largest product_id in price_history"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT MIN(product_id), MAX(product_id) FROM price_history")
+        return cursor.fetchone()
+    finally:
+        cursor.close()
+
+def compact_product_range(conn, first_id, last_id, dry_run=False):
+    """Delete rows whose prices equal the previous row of the same variant.
+
+    Held (quarantined) rows are neither compared against nor deleted, matching
+    the change-only insert, so readers that skip them see the same prices.
+    Works on one product_id range per transaction so locks and WAL stay bounded.
+    Returns the number of redundant rows found (and deleted unless dry_run).
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"""
+            WITH ordered AS (
+                SELECT
+                    id, low_price, high_price, mid_price, market_price, direct_low_price,
+                    LAG(low_price) OVER w AS prev_low,
+                    LAG(high_price) OVER w AS prev_high,
+                    LAG(mid_price) OVER w AS prev_mid,
+                    LAG(market_price) OVER w AS prev_market,
+                    LAG(direct_low_price) OVER w AS prev_direct_low,
+                    ROW_NUMBER() OVER w AS rn
+                FROM price_history
+                WHERE product_id BETWEEN %s AND %s
+                  AND period_type = 'daily'
+                  AND {NOT_QUARANTINED_SQL.format(alias="price_history")}
+                WINDOW w AS (PARTITION BY product_id, sub_type_name ORDER BY date_point)
+            ),
+            redundant AS (
+                SELECT id
+                FROM ordered
+                WHERE rn > 1
+                  AND (low_price, high_price, mid_price, market_price, direct_low_price)
+                      IS NOT DISTINCT FROM
+                      (prev_low, prev_high, prev_mid, prev_market, prev_direct_low)
+            )
+            DELETE FROM price_history ph
+            USING redundant
+            WHERE ph.id = redundant.id
+        """, (first_id, last_id))
+        removed = cursor.rowcount
+        if dry_run:
+            conn.rollback()
+        else:
+            conn.commit()
+        return removed
+    except Exception as e:
+        conn.rollback()
+        logging.error(f"Error compacting products {first_id}-{last_id}: {e}")
+        return 0
+    finally:
+        cursor.close()
+
+def main():
+    """One-time conversion of a full daily price_history into change-only rows"""
+    parser = argparse.ArgumentParser(description="Remove price_history rows that repeat the previous day's prices")
+    parser.add_argument("--dry-run", action="store_true", help="count redundant rows without deleting them")
+    parser.add_argument("--vacuum-full", action="store_true",
+                        help="rewrite the table afterwards to return the space to the OS (takes an exclusive lock)")
+    args = parser.parse_args()
+
+    logging.info("Starting price_history compaction")
+    start_time = datetime.now()
+
+    if STORAGE_MODE != "changes":
+        # Compacted history is still read correctly, but full-mode loads would
+        # keep appending unchanged rows on top of it
+        logging.warning("PRICE_STORAGE_MODE is not 'changes'; set it before the next ETL run")
+
+    try:
+        conn = psycopg2.connect(**DB_PARAMS)
+
+        min_id, max_id = get_product_id_bounds(conn)
+        if min_id is None:
+            logging.info("price_history is empty, nothing to compact")
+            return
+
+        total_removed = 0
+        for first_id in range(min_id, max_id + 1, PRODUCT_BATCH_SIZE):
+            last_id = first_id + PRODUCT_BATCH_SIZE - 1
+            removed = compact_product_range(conn, first_id, last_id, args.dry_run)
+            total_removed += removed
+            if removed:
+                logging.info(f"Products {first_id}-{last_id}: {'found' if args.dry_run else 'removed'} {removed} redundant rows")
+
+        if not args.dry_run:
+            conn.autocommit = True
+            cursor = conn.cursor()
+            if args.vacuum_full:
+                logging.info("Running VACUUM FULL on price_history")
+                cursor.execute("VACUUM FULL ANALYZE price_history")
+            else:
+                cursor.execute("VACUUM ANALYZE price_history")
+            cursor.close()
+
+        conn.close()
+
+        duration = (datetime.now() - start_time).total_seconds() / 60.0
+        logging.info(f"Compaction completed in {duration:.2f} minutes, {'found' if args.dry_run else 'removed'} {total_removed} redundant rows")
+
+    except Exception as e:
+        logging.error(f"Compaction failed: {e}")
+
+if __name__ == "__main__":
+    main()
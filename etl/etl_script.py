@@ -1,15 +1,25 @@
 #!/usr/bin/env python3
 
 import requests
+from requests.adapters import HTTPAdapter
 import pandas as pd
 import psycopg2
-from psycopg2.extras import execute_batch
+from psycopg2.pool import ThreadedConnectionPool
+from psycopg2.extras import execute_batch, execute_values
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import io
 import logging
-from datetime import datetime
+from datetime import datetime, date
 import os
 from dotenv import load_dotenv
 
+from card_search import ensure_search_index, search_vector_sql, search_columns_changed_sql
+from job_lock import run_locked
+from price_cube import update_price_cube
+from price_snapshot import ensure_snapshot_table, update_price_snapshot
+from price_storage import insert_prices, rows_in_effect
+from price_validation import screen_prices
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -33,10 +43,30 @@ DB_PARAMS = {
 }
 
 # API configuration
-CATEGORY_ID = 3  # Pokémon
+# Comma separated tcgcsv category ids to load, e.g. "3,68" (3 = Pokémon)
+CATEGORY_IDS = [int(c) for c in os.getenv("TCG_CATEGORY_IDS", "3").split(",") if c.strip()]
+MAX_CATEGORY_WORKERS = int(os.getenv("ETL_CATEGORY_WORKERS", "4"))
 BASE_URL = "https://tcgcsv.com/tcgplayer"
-GROUPS_URL = f"{BASE_URL}/{CATEGORY_ID}/groups"
-PRODUCTS_URL_TEMPLATE = f"{BASE_URL}/{CATEGORY_ID}/{{group_id}}/ProductsAndPrices.csv"
+GROUPS_URL_TEMPLATE = f"{BASE_URL}/{{category_id}}/groups"
+PRODUCTS_URL_TEMPLATE = f"{BASE_URL}/{{category_id}}/{{group_id}}/ProductsAndPrices.csv"
+
+# One HTTP session for every worker so connections to tcgcsv are reused
+HTTP_SESSION = requests.Session()
+HTTP_SESSION.mount("https://", HTTPAdapter(pool_connections=MAX_CATEGORY_WORKERS, pool_maxsize=MAX_CATEGORY_WORKERS))
+
+# Transaction batching for the groups, products and prices writes:
+#   group  - commit after every group (default, previous behaviour)
+#   groups - commit after every ETL_COMMIT_EVERY groups (default 10)
+#   rows   - commit once at least ETL_COMMIT_EVERY rows are pending (default 5000)
+#   single - one transaction per category (atomic daily snapshot of each;
+#            categories load on their own connections, so with several
+#            CATEGORY_IDS one can commit while another rolls back)
+# Each group is wrapped in a savepoint, so a bad group is rolled back on its own
+# without discarding the other groups in the same transaction.
+COMMIT_MODE = os.getenv("ETL_COMMIT_MODE", "group")
+COMMIT_MODES = ("group", "groups", "rows", "single")
+COMMIT_EVERY_DEFAULTS = {"groups": 10, "rows": 5000}  # ETL_COMMIT_EVERY is in the mode's unit
+COMMIT_EVERY = int(os.getenv("ETL_COMMIT_EVERY")) if os.getenv("ETL_COMMIT_EVERY") else None
 
 def get_db_connection():
     """Establish a connection to the Postgres database"""
@@ -48,11 +78,22 @@ def get_db_connection():
         logging.error(f"Error connecting to database: {e}")
         raise
 
-def fetch_groups():
-    """Fetch all groups (sets) for Pokémon"""
+def get_db_pool(size):
+    """Create a connection pool with one connection per category worker"""
+    try:
+        pool = ThreadedConnectionPool(1, size, **DB_PARAMS)
+        logging.info(f"Database connection pool established with up to {size} connections")
+        return pool
+    except Exception as e:
+        logging.error(f"Error creating database connection pool: {e}")
+        raise
+
+def fetch_groups(category_id):
+    """Fetch all groups (sets) for a category"""
+    url = GROUPS_URL_TEMPLATE.format(category_id=category_id)
     try:
-        logging.info(f"Fetching groups from {GROUPS_URL}")
-        response = requests.get(GROUPS_URL, timeout=30)
+        logging.info(f"Fetching groups from {url}")
+        response = HTTP_SESSION.get(url, timeout=30)
         response.raise_for_status()
         groups_data = response.json()
         
@@ -61,21 +102,22 @@ def fetch_groups():
             groups.append({
                 "groupId": group.get("groupId"),
                 "groupName": group.get("name"),
-                "modifiedOn": group.get("modifiedOn", datetime.now().isoformat())
+                "modifiedOn": group.get("modifiedOn", datetime.now().isoformat()),
+                "publishedOn": group.get("publishedOn")
             })
         
-        logging.info(f"Successfully fetched {len(groups)} groups")
+        logging.info(f"Successfully fetched {len(groups)} groups for category {category_id}")
         return groups
     except Exception as e:
-        logging.error(f"Error fetching groups: {e}")
+        logging.error(f"Error fetching groups for category {category_id}: {e}")
         return []
 
-def fetch_products_for_group(group_id):
+def fetch_products_for_group(category_id, group_id):
     """Fetch all products (cards) for a specific group"""
-    url = PRODUCTS_URL_TEMPLATE.format(group_id=group_id)
+    url = PRODUCTS_URL_TEMPLATE.format(category_id=category_id, group_id=group_id)
     try:
         logging.info(f"Fetching products for group {group_id} from {url}")
-        response = requests.get(url, timeout=30)
+        response = HTTP_SESSION.get(url, timeout=30)
         response.raise_for_status()
         
         df = pd.read_csv(io.StringIO(response.text))
@@ -85,48 +127,183 @@ def fetch_products_for_group(group_id):
         logging.error(f"Error fetching products for group {group_id}: {e}")
         return pd.DataFrame()
 
-def update_groups(conn, groups):
-    """Update the groups table with current data"""
+def ensure_group_columns(conn):
+    """Add groups.published_on (the set's release date) if it is missing"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("ALTER TABLE groups ADD COLUMN IF NOT EXISTS published_on DATE")
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logging.error(f"Error adding groups.published_on: {e}")
+        raise
+    finally:
+        cursor.close()
+
+def parse_published_on(value):
+    """Date part of tcgcsv's publishedOn timestamp, or None"""
+    try:
+        return datetime.fromisoformat(value[:10]).date() if value else None
+    except ValueError:
+        return None
+
+def update_groups(conn, groups, category_id, batcher=None):
+    """Update the groups table with current data.
+
+    Runs inside the batcher's transaction like the per-group writes, so in
+    single mode the groups are part of the same atomic snapshot.
+    """
     if not groups:
         logging.warning("No groups to update")
         return
+    
+    if batcher is None:
+        batcher = TransactionBatcher(conn, mode="group")
         
     cursor = conn.cursor()
+    batcher.begin_group()
     try:
         values = [(
             group["groupId"], 
             group["groupName"], 
-            CATEGORY_ID,
-            datetime.now()
+            category_id,
+            datetime.now(),
+            parse_published_on(group.get("publishedOn"))
         ) for group in groups]
         
         query = """
-            INSERT INTO groups (group_id, group_name, category_id, modified_on)
-            VALUES (%s, %s, %s, %s)
+            INSERT INTO groups (group_id, group_name, category_id, modified_on, published_on)
+            VALUES (%s, %s, %s, %s, %s)
             ON CONFLICT (group_id) DO UPDATE SET
                 group_name = EXCLUDED.group_name,
-                modified_on = EXCLUDED.modified_on
+                modified_on = EXCLUDED.modified_on,
+                published_on = COALESCE(EXCLUDED.published_on, groups.published_on)
         """
         
         execute_batch(cursor, query, values)
-        conn.commit()
+        batcher.end_group(len(values))
         logging.info(f"Successfully updated {len(values)} groups")
     except Exception as e:
-        conn.rollback()
+        batcher.fail_group(f"groups of category {category_id}")
         logging.error(f"Error updating groups: {e}")
     finally:
         cursor.close()
 
-def update_products_and_prices(conn, df, group_id):
+class TransactionBatcher:
+    """Batch per-group writes into larger transactions according to COMMIT_MODE"""
+
+    def __init__(self, conn, mode=COMMIT_MODE, every=COMMIT_EVERY):
+        if mode not in COMMIT_MODES:
+            raise ValueError(f"Unknown commit mode '{mode}', expected one of {', '.join(COMMIT_MODES)}")
+        if every is None:
+            every = COMMIT_EVERY_DEFAULTS.get(mode, 1)
+        self.conn = conn
+        self.mode = mode
+        self.every = max(1, every)
+        self.pending_groups = 0
+        self.pending_rows = 0
+        self.failed_groups = []
+        self.commits = 0
+
+    def begin_group(self):
+        """Open a savepoint for the next group"""
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute("SAVEPOINT etl_group")
+        finally:
+            cursor.close()
+
+    def end_group(self, rows):
+        """Release the group's savepoint and commit if the batch is full"""
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute("RELEASE SAVEPOINT etl_group")
+        finally:
+            cursor.close()
+
+        self.pending_groups += 1
+        self.pending_rows += rows
+
+        if self.mode == "group":
+            self.commit()
+        elif self.mode == "groups" and self.pending_groups >= self.every:
+            self.commit()
+        elif self.mode == "rows" and self.pending_rows >= self.every:
+            self.commit()
+
+    def fail_group(self, group_id):
+        """Roll back only the failed group, keeping the rest of the open transaction"""
+        self.failed_groups.append(group_id)
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute("ROLLBACK TO SAVEPOINT etl_group")
+            cursor.execute("RELEASE SAVEPOINT etl_group")
+        except Exception as e:
+            # The connection itself is broken, nothing pending can be kept
+            logging.error(f"Could not roll back to savepoint for group {group_id}: {e}")
+            self.conn.rollback()
+            self.pending_groups = 0
+            self.pending_rows = 0
+        finally:
+            cursor.close()
+
+    def commit(self):
+        """Commit everything pending"""
+        if self.pending_groups == 0:
+            return
+        self.conn.commit()
+        self.commits += 1
+        logging.info(f"Committed {self.pending_groups} groups ({self.pending_rows} rows)")
+        self.pending_groups = 0
+        self.pending_rows = 0
+
+    def finish(self):
+        """Commit the remaining work; in single mode any failed group aborts the whole snapshot"""
+        if self.mode == "single" and self.failed_groups:
+            self.conn.rollback()
+            logging.error(f"Rolled back daily snapshot: {len(self.failed_groups)} groups failed ({self.failed_groups})")
+            self.pending_groups = 0
+            self.pending_rows = 0
+            return False
+        self.commit()
+        logging.info(f"Made {self.commits} commits ({self.mode} mode), {len(self.failed_groups)} groups failed")
+        return True
+
+PRODUCT_COLUMNS = """
+    product_id, category_id, group_id, name, clean_name,
+    url, image_url, image_count, sub_type_name, modified_on,
+    ext_card_type, ext_hp, ext_number, ext_rarity, ext_resistance,
+    ext_retreat_cost, ext_stage, ext_upc, ext_weakness, ext_card_text,
+    ext_attack1, ext_attack2, ext_attack3, ext_attack4
+"""
+
+# Explicit casts so every VALUES row resolves to the products column types
+PRODUCT_VALUES_TEMPLATE = (
+    "(%s::integer, %s::integer, %s::integer, %s::varchar, %s::varchar,"
+    " %s::text, %s::text, %s::integer, %s::varchar, %s::timestamp,"
+    " %s::varchar, %s::varchar, %s::varchar, %s::varchar, %s::varchar,"
+    " %s::varchar, %s::varchar, %s::varchar, %s::varchar, %s::text,"
+    " %s::text, %s::text, %s::text, %s::text)"
+)
+
+def update_products_and_prices(conn, df, group_id, category_id, batcher=None):
     """Update products table and insert today's prices into price_history"""
     if df.empty:
         logging.warning(f"No data to update for group {group_id}")
         return
     
+    if batcher is None:
+        batcher = TransactionBatcher(conn, mode="group")
+    
     cursor = conn.cursor()
+    batcher.begin_group()
     try:
-        product_values = []
+        # One products row per product_id: the CSV repeats a card once per
+        # sub-type, and a multi-row upsert may not touch the same row twice.
+        # The last sub-type wins, as it did with row-by-row upserts.
+        product_values = {}
         price_values = []
+        seen_price_keys = set()
         
         now = datetime.now()
         
@@ -134,10 +311,12 @@ def update_products_and_prices(conn, df, group_id):
             try:
                 product_id = int(row['productId'])
                 sub_type_name = row.get('subTypeName', '')
+                if pd.isna(sub_type_name):
+                    sub_type_name = ''
                 
                 # Prepare data for products table
-                product_values.append((
-                    product_id, CATEGORY_ID, group_id,
+                product_values[product_id] = (
+                    product_id, category_id, group_id,
                     row.get('name', ''), row.get('cleanName', ''),
                     row.get('url', ''), row.get('imageUrl', ''),
                     int(row.get('imageCount', 0) or 0),
@@ -149,7 +328,7 @@ def update_products_and_prices(conn, df, group_id):
                     row.get('extWeakness', ''), row.get('extCardText', ''),
                     row.get('extAttack1', ''), row.get('extAttack2', ''),
                     row.get('extAttack3', ''), row.get('extAttack4', '')
-                ))
+                )
                 
                 # Prepare data for price_history table
                 market_price = float(row['marketPrice']) if pd.notna(row['marketPrice']) else None
@@ -158,29 +337,34 @@ def update_products_and_prices(conn, df, group_id):
                 mid_price = float(row['midPrice']) if pd.notna(row['midPrice']) else None
                 high_price = float(row['highPrice']) if pd.notna(row['highPrice']) else None
                 
+                # The CSV can list the same variant twice; keep the first so the
+                # batch never conflicts with itself on the natural key
+                price_key = (product_id, sub_type_name)
+                if price_key in seen_price_keys:
+                    continue
+                
                 if any(p is not None for p in [market_price, direct_low, low_price, mid_price, high_price]):
+                    seen_price_keys.add(price_key)
+                    # group_id, the date and the NULL columns are bound once by insert_prices
                     price_values.append((
-                        product_id, group_id, sub_type_name,
-                        now.date(), 'daily', None,
-                        None, None, # open_price and close_price are NULL for daily
+                        product_id, sub_type_name,
                         low_price, high_price, mid_price,
-                        market_price, direct_low, None # volume
+                        market_price, direct_low
                     ))
             except (ValueError, TypeError) as e:
                 logging.error(f"Error processing row for product ID {row.get('productId')}: {e}, skipping")
                 continue
         
-        # Update products table
+        # Update products table. search_vector is only recomputed for new rows and
+        # rows whose searchable text changed; otherwise the stored vector is kept,
+        # so unchanged products leave the search indexes untouched.
         if product_values:
-            products_query = """
+            products_query = f"""
                 INSERT INTO products (
-                    product_id, category_id, group_id, name, clean_name, 
-                    url, image_url, image_count, sub_type_name, modified_on,
-                    ext_card_type, ext_hp, ext_number, ext_rarity, ext_resistance,
-                    ext_retreat_cost, ext_stage, ext_upc, ext_weakness, ext_card_text,
-                    ext_attack1, ext_attack2, ext_attack3, ext_attack4
+                    {PRODUCT_COLUMNS}, search_vector
                 )
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                SELECT v.*, {search_vector_sql('v')}
+                FROM (VALUES %s) AS v({PRODUCT_COLUMNS})
                 ON CONFLICT (product_id) DO UPDATE SET
                     name = EXCLUDED.name, clean_name = EXCLUDED.clean_name,
                     url = EXCLUDED.url, image_url = EXCLUDED.image_url,
@@ -192,63 +376,121 @@ def update_products_and_prices(conn, df, group_id):
                     ext_upc = EXCLUDED.ext_upc, ext_weakness = EXCLUDED.ext_weakness,
                     ext_card_text = EXCLUDED.ext_card_text, ext_attack1 = EXCLUDED.ext_attack1,
                     ext_attack2 = EXCLUDED.ext_attack2, ext_attack3 = EXCLUDED.ext_attack3,
-                    ext_attack4 = EXCLUDED.ext_attack4;
+                    ext_attack4 = EXCLUDED.ext_attack4,
+                    search_vector = CASE
+                        WHEN products.search_vector IS NULL
+                          OR {search_columns_changed_sql('products', 'EXCLUDED')}
+                        THEN EXCLUDED.search_vector
+                        ELSE products.search_vector
+                    END
             """
-            execute_batch(cursor, products_query, product_values)
+            execute_values(cursor, products_query, list(product_values.values()), template=PRODUCT_VALUES_TEMPLATE, page_size=1000)
+        
+        # Screen today's prices: invalid records are dropped, suspicious ones quarantined
+        price_values, quarantined = screen_prices(cursor, group_id, now.date(), price_values)
         
         # Insert today's prices into price_history
-        if price_values:
-            price_query = """
-                INSERT INTO price_history (
-                    product_id, group_id, sub_type_name, date_point, period_type, end_date,
-                    open_price, close_price, low_price, high_price, mid_price,
-                    market_price, direct_low_price, volume
-                )
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                ON CONFLICT DO NOTHING;
-            """
-            execute_batch(cursor, price_query, price_values)
+        inserted = insert_prices(cursor, group_id, now.date(), price_values)
         
-        conn.commit()
-        logging.info(f"Successfully updated {len(product_values)} products and inserted {len(price_values)} price records for group {group_id}")
+        # Only prices in effect today that passed screening can move the snapshot
+        snapshot_rows = rows_in_effect(price_values, inserted, now.date())
+        update_price_snapshot(cursor, [row for row in snapshot_rows if (row[0], row[1]) not in quarantined])
+        
+        batcher.end_group(len(product_values) + len(inserted))
+        logging.info(f"Successfully updated {len(product_values)} products and inserted {len(inserted)} of {len(price_values)} price records for group {group_id}")
     except Exception as e:
-        conn.rollback()
+        batcher.fail_group(group_id)
         logging.error(f"Error updating data for group {group_id}: {e}")
     finally:
         cursor.close()
 
-def main():
-    """Main daily ETL function"""
-    logging.info("Starting daily update ETL process")
-    start_time = datetime.now()
-    
+def process_category(pool, category_id):
+    """Run the daily update for one category on its own pooled connection.
+
+    Returns a summary dict; errors are logged and reported here so one failing
+    category never affects the others.
+    """
+    prefix = f"[category {category_id}]"
+    summary = {"category_id": category_id, "groups": 0, "failed_groups": [], "ok": False}
+    conn = pool.getconn()
     try:
-        conn = get_db_connection()
-        groups = fetch_groups()
+        groups = fetch_groups(category_id)
         
         if not groups:
-            logging.error("No groups fetched. Check the API or network connection.")
-            return
+            logging.error(f"{prefix} No groups fetched. Check the API or network connection.")
+            return summary
             
-        update_groups(conn, groups)
+        batcher = TransactionBatcher(conn)
+        update_groups(conn, groups, category_id, batcher)
         
         total_groups = len(groups)
         for i, group in enumerate(groups):
             group_id = group["groupId"]
-            logging.info(f"Processing group {i+1}/{total_groups}: {group['groupName']} ({group_id})")
+            logging.info(f"{prefix} Processing group {i+1}/{total_groups}: {group['groupName']} ({group_id})")
             
-            df = fetch_products_for_group(group_id)
+            df = fetch_products_for_group(category_id, group_id)
             if not df.empty:
-                update_products_and_prices(conn, df, group_id)
+                update_products_and_prices(conn, df, group_id, category_id, batcher)
         
-        conn.close()
+        summary["ok"] = batcher.finish()
+        summary["groups"] = total_groups
+        summary["failed_groups"] = batcher.failed_groups
+        return summary
+    except Exception as e:
+        conn.rollback()
+        logging.error(f"{prefix} Daily update failed: {e}")
+        return summary
+    finally:
+        pool.putconn(conn)
+
+def main():
+    """Main daily ETL function; returns True when every category loaded cleanly"""
+    logging.info(f"Starting daily update ETL process for categories {CATEGORY_IDS}")
+    start_time = datetime.now()
+    pool = None
+    
+    try:
+        workers = max(1, min(len(CATEGORY_IDS), MAX_CATEGORY_WORKERS))
+        pool = get_db_pool(workers)
+        
+        conn = pool.getconn()
+        ensure_snapshot_table(conn)
+        ensure_search_index(conn)
+        ensure_group_columns(conn)
+        pool.putconn(conn)
+        
+        all_ok = True
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(process_category, pool, category_id) for category_id in CATEGORY_IDS]
+            for future in as_completed(futures):
+                summary = future.result()
+                all_ok = all_ok and summary["ok"]
+                status = "completed" if summary["ok"] else "FAILED"
+                logging.info(f"[category {summary['category_id']}] {status}: {summary['groups']} groups, {len(summary['failed_groups'])} failed")
+        
+        # Write today's prices to the on-disk price cube, rewriting today when
+        # this is a rerun; a failure here leaves the cube one day behind and
+        # the next run catches up
+        conn = pool.getconn()
+        try:
+            update_price_cube(conn, since=date.today())
+        except Exception as e:
+            logging.error(f"Error updating price cube: {e}")
+        finally:
+            pool.putconn(conn)
         
         end_time = datetime.now()
         duration = (end_time - start_time).total_seconds() / 60.0
         logging.info(f"Daily update ETL process completed in {duration:.2f} minutes")
+        return all_ok
         
     except Exception as e:
         logging.error(f"Daily update ETL process failed: {e}")
+        return False
+    finally:
+        # Close database connections, also when a setup step failed
+        if pool is not None:
+            pool.closeall()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    run_locked("daily_etl", main)
\ No newline at end of file
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+
+import psycopg2
+import numpy as np
+import pandas as pd
+import argparse
+import logging
+from datetime import timedelta
+import os
+import time
+from dotenv import load_dotenv
+
+from history_frame import KEY_COLUMNS, load_price_history, get_last_loaded_date, pivot_daily, copy_dataframe
+from price_storage import STORAGE_MODE
+from price_validation import ensure_quarantine_table
+
+# Load environment variables
+load_dotenv()
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+    handlers=[
+        logging.FileHandler("group_price_index.log"),
+        logging.StreamHandler()
+    ]
+)
+
+# Database connection parameters
+DB_PARAMS = {
+    "host": os.getenv("DB_HOST", "localhost"),
+    "database": os.getenv("DB_NAME", "pokemon_tcg"),
+    "user": os.getenv("DB_USER", "postgres"),
+    "password": os.getenv("DB_PASSWORD", ""),
+    "port": os.getenv("DB_PORT", "5432")
+}
+
+INDEX_BASE = 100.0
+TOP_N = int(os.getenv("GROUP_INDEX_TOP_N", "10"))
+# A card missing for up to this many days keeps its last price instead of
+# leaving the index; change-only histories are always filled
+GAP_FILL_DAYS = 7
+
+INDEX_TYPES = ["equal", "price", f"top{TOP_N}"]
+INDEX_COLUMNS = ["group_id", "index_type", "date_point", "value", "constituents"]
+
+def ensure_index_table(conn):
+    """Create the group_price_index table if it does not exist yet"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS group_price_index (
+                group_id      INTEGER     NOT NULL,
+                index_type    VARCHAR(10) NOT NULL,
+                date_point    DATE        NOT NULL,
+                value         REAL        NOT NULL,
+                constituents  INTEGER     NOT NULL,
+                PRIMARY KEY (group_id, index_type, date_point)
+            )
+        """)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logging.error(f"Error creating group_price_index table: {e}")
+        raise
+    finally:
+        cursor.close()
+
+def get_last_index_values(conn):
+    """Last stored date and, per (group_id, index_type), the value on that date"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT MAX(date_point) FROM group_price_index")
+        last_date = cursor.fetchone()[0]
+        if last_date is None:
+            return None, {}
+        cursor.execute("""
+            SELECT group_id, index_type, value
+            FROM group_price_index
+            WHERE date_point = %s
+        """, (last_date,))
+        return last_date, {(group_id, index_type): value for group_id, index_type, value in cursor.fetchall()}
+    finally:
+        cursor.close()
+
+def within_group_rank(prices, group_codes, group_starts):
+    """Rank of each column's price within its group on every row (0 = most expensive).
+
+    Columns must be sorted by group. NaN prices rank last. One argsort over
+    the whole matrix: the group code dominates the key, so each group's
+    columns stay contiguous and the position minus the group's first column
+    is the rank.
+    """
+    key = group_codes[None, :] * 1e10 + np.where(np.isnan(prices), 5e9, -prices.astype(np.float64))
+    order = np.argsort(key, axis=1, kind="stable")
+    positions = np.arange(prices.shape[1]) - group_starts[group_codes]
+    rank = np.empty(prices.shape, dtype=np.int64)
+    np.put_along_axis(rank, order, np.broadcast_to(positions, prices.shape), axis=1)
+    return rank
+
+def compute_group_indexes(filled, column_groups, top_n=TOP_N, base_date=None, base_values=None):
+    """Chain-linked daily indexes for every group in one pass over the matrix.
+
+    filled is a (day x variant) price matrix and column_groups the group_id of
+    each column. Each day's link compares the cards priced on both that day
+    and the day before, so cards entering or leaving a set never jump the index:
+
+      equal     mean of the cards' price relatives
+      price     sum of today's prices / sum of yesterday's (price weighted)
+      top<N>    mean price relative of the N most expensive cards of yesterday
+
+    Indexes start at INDEX_BASE on a group's first priced day, or continue from
+    base_values[(group_id, index_type)] when only days after base_date are new.
+    Returns a long DataFrame in INDEX_COLUMNS order for the days after base_date.
+    """
+    base_values = base_values or {}
+    order = np.argsort(column_groups, kind="stable")
+    prices = filled.values[:, order]
+    groups, group_starts, group_codes = np.unique(column_groups[order], return_index=True, return_inverse=True)
+
+    prev, cur = prices[:-1], prices[1:]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        paired = ~np.isnan(prev) & ~np.isnan(cur) & (prev > 0)
+        relatives = np.where(paired, cur / prev, 0)
+    top = paired & (within_group_rank(prev, group_codes, group_starts) < top_n)
+
+    def group_sum(values):
+        return np.add.reduceat(values, group_starts, axis=1)
+
+    count = group_sum(paired.astype(np.int32))
+    top_count = group_sum(top.astype(np.int32))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        links = {
+            "equal": (group_sum(relatives) / count, count),
+            "price": (group_sum(np.where(paired, cur, 0)) / group_sum(np.where(paired, prev, 0)), count),
+            f"top{top_n}": (group_sum(np.where(top, relatives, 0)) / top_count, top_count),
+        }
+
+    days = filled.index
+    first_output = 0
+    if base_date is not None:
+        first_output = max(1, int(np.searchsorted(days.values, np.datetime64(base_date, "ns"), side="right")))
+    started = np.logical_or.accumulate(group_sum((~np.isnan(prices)).astype(np.int32)) > 0, axis=0)
+
+    frames = []
+    for index_type, (link, constituents) in links.items():
+        # Days without any pair (and days up to the stored base) carry the level forward
+        link = np.where(np.isfinite(link), link, 1.0)
+        link[:max(first_output - 1, 0)] = 1.0
+        level = np.vstack([np.ones((1, len(groups))), np.cumprod(link, axis=0)])
+        base = np.array([base_values.get((g, index_type), INDEX_BASE) for g in groups])
+        values = np.where(started, base[None, :] * level, np.nan)[first_output:]
+        counts = np.vstack([np.zeros((1, len(groups)), dtype=np.int32), constituents])[first_output:]
+
+        day_idx, group_idx = np.nonzero(~np.isnan(values))
+        frames.append(pd.DataFrame({
+            "group_id": groups[group_idx],
+            "index_type": index_type,
+            "date_point": days.values[first_output:][day_idx].astype("datetime64[D]"),
+            "value": values[day_idx, group_idx].astype(np.float32),
+            "constituents": counts[day_idx, group_idx],
+        }))
+
+    return pd.concat(frames, ignore_index=True)[INDEX_COLUMNS]
+
+def store_indexes(conn, indexes, from_date=None):
+    """Replace the stored index rows from from_date on (or all of them) in one transaction"""
+    cursor = conn.cursor()
+    try:
+        if from_date is None:
+            cursor.execute("DELETE FROM group_price_index")
+        else:
+            cursor.execute("DELETE FROM group_price_index WHERE date_point >= %s", (from_date,))
+        copied = copy_dataframe(cursor, indexes, "group_price_index", INDEX_COLUMNS)
+        conn.commit()
+        return copied
+    except Exception as e:
+        conn.rollback()
+        logging.error(f"Error storing group price indexes: {e}")
+        return 0
+    finally:
+        cursor.close()
+
+def main():
+    """Compute daily price indexes per group, appending the days since the last run"""
+    parser = argparse.ArgumentParser(description="Compute daily equal-weight, price-weighted and top-N indexes per group")
+    parser.add_argument("--rebuild", action="store_true", help="recompute every index from the full history")
+    args = parser.parse_args()
+
+    logging.info("Starting group price index calculation")
+    start_time = time.time()
+
+    try:
+        conn = psycopg2.connect(**DB_PARAMS)
+        ensure_index_table(conn)
+        ensure_quarantine_table(conn)  # load_price_history skips held rows
+        # The last loaded day, not today: a day filled forward before its load
+        # would be kept as is by the next run
+        as_of = get_last_loaded_date(conn)
+        if as_of is None:
+            logging.info("No price history to index")
+            return
+
+        base_date, base_values = (None, {}) if args.rebuild else get_last_index_values(conn)
+        if base_date is not None and base_date >= as_of:
+            logging.info("Group price indexes are already up to date")
+            return
+        # Enough history before the base day for the gap fill to see each card's last price.
+        # Change-only rows stay in effect indefinitely, so there every variant is
+        # seeded with its row in effect at load_start instead.
+        load_start = base_date - timedelta(days=GAP_FILL_DAYS) if base_date is not None else None
+
+        history = load_price_history(conn, columns=["market_price"], start_date=load_start,
+                                     end_date=as_of, extra_columns=["group_id"],
+                                     seed_start=STORAGE_MODE == "changes")
+        if history.empty:
+            logging.info("No price history to index")
+            return
+        variant_groups = history.drop_duplicates(KEY_COLUMNS, keep="last").set_index(KEY_COLUMNS)["group_id"]
+        ffill_limit = None if STORAGE_MODE == "changes" else GAP_FILL_DAYS
+        filled = pivot_daily(history, "market_price", start_date=load_start, end_date=as_of, ffill_limit=ffill_limit)
+        del history
+        column_groups = variant_groups.reindex(filled.columns).values.astype(np.int64)
+        logging.info(f"Built price matrix of {filled.shape[0]} days x {filled.shape[1]} variants in {len(np.unique(column_groups))} groups")
+
+        compute_start = time.time()
+        indexes = compute_group_indexes(filled, column_groups, base_date=base_date, base_values=base_values)
+        logging.info(f"Computed {len(indexes)} index values in {time.time() - compute_start:.2f} seconds")
+
+        from_date = base_date + timedelta(days=1) if base_date is not None else None
+        stored = store_indexes(conn, indexes, from_date)
+        conn.close()
+
+        duration = time.time() - start_time
+        logging.info(f"Group price index calculation completed in {duration:.2f} seconds, stored {stored} rows")
+
+    except Exception as e:
+        logging.error(f"Group price index calculation failed: {e}")
+
+if __name__ == "__main__":
+    main()
@@ -5,13 +5,20 @@ import tempfile
 import shutil
 import json
 import requests
+from requests.adapters import HTTPAdapter
 import py7zr
 import psycopg2
-from psycopg2.extras import execute_batch
+from psycopg2.pool import ThreadedConnectionPool
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, date, timedelta
 from dotenv import load_dotenv
 import logging
 
+from price_cube import update_price_cube
+from price_snapshot import ensure_snapshot_table, update_price_snapshot
+from price_storage import insert_prices, rows_in_effect
+from price_validation import screen_prices
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -35,13 +42,19 @@ DB_PARAMS = {
 }
 
 # Constants
-CATEGORY_ID = 3  # Pokémon
+# Comma separated tcgcsv category ids to load, e.g. "3,68" (3 = Pokémon)
+CATEGORY_IDS = [int(c) for c in os.getenv("TCG_CATEGORY_IDS", "3").split(",") if c.strip()]
+MAX_CATEGORY_WORKERS = int(os.getenv("ETL_CATEGORY_WORKERS", "4"))
 TEMP_DIR = "./temp_archives"
 ARCHIVE_BASE_URL = "https://tcgcsv.com/archive/tcgplayer"
 
 # Create temp directory if it doesn't exist
 os.makedirs(TEMP_DIR, exist_ok=True)
 
+# One HTTP session for the marker check and all archive downloads
+HTTP_SESSION = requests.Session()
+HTTP_SESSION.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=MAX_CATEGORY_WORKERS))
+
 def daterange_end_inclusive(start_date, end_date):
     """Generate a range of dates, inclusive of end date"""
     days = int((end_date - start_date).days) + 1
@@ -51,7 +64,7 @@ def daterange_end_inclusive(start_date, end_date):
 def get_latest_date():
     """Get the latest date from tcgcsv.com"""
     try:
-        response = requests.get("https://tcgcsv.com/last-updated.txt", timeout=10)
+        response = HTTP_SESSION.get("https://tcgcsv.com/last-updated.txt", timeout=10)
         response.raise_for_status()
         date_str = response.text.strip()
         return datetime.fromisoformat(date_str).date()
@@ -61,14 +74,18 @@ def get_latest_date():
         return date.today()
 
 def download_and_extract_archive(date_str):
-    """Download and extract 7z archive for a specific date"""
+    """Download and extract 7z archive for a specific date.
+
+    The archive holds every category, so it is fetched and decompressed once
+    per date and the returned directory is shared by all category workers.
+    """
     archive_url = f"{ARCHIVE_BASE_URL}/prices-{date_str}.ppmd.7z"
     archive_path = os.path.join(TEMP_DIR, f"prices-{date_str}.ppmd.7z")
     extract_path = os.path.join(TEMP_DIR, f"prices-{date_str}")
     
     try:
         logging.info(f"Downloading archive for {date_str} from {archive_url}")
-        response = requests.get(archive_url, stream=True, timeout=60)
+        response = HTTP_SESSION.get(archive_url, stream=True, timeout=60)
         response.raise_for_status()
         
         with open(archive_path, 'wb') as f:
@@ -79,9 +96,8 @@ def download_and_extract_archive(date_str):
         with py7zr.SevenZipFile(archive_path, mode='r') as archive:
             archive.extractall(path=extract_path)
         
-        # Return path to category 3 directory
-        category_path = os.path.join(extract_path, date_str, str(CATEGORY_ID))
-        return category_path
+        # Return path to the date directory holding one directory per category
+        return os.path.join(extract_path, date_str)
     except Exception as e:
         logging.error(f"Error downloading/extracting archive for {date_str}: {e}")
         return None
@@ -105,7 +121,12 @@ def get_existing_product_ids(conn):
         cursor.close()
 
 def process_group_prices(category_path, group_id, date_val, existing_product_ids):
-    """Process price data for a specific group"""
+    """Process price data for a specific group.
+
+    Returns compact (product_id, sub_type_name, low, high, mid, market, direct_low)
+    tuples. group_id and the date are the same for every record of a group, so
+    they are not repeated per record and are bound once at insert time.
+    """
     prices_path = os.path.join(category_path, str(group_id), "prices")
     
     if not os.path.exists(prices_path):
@@ -120,6 +141,7 @@ def process_group_prices(category_path, group_id, date_val, existing_product_ids
             return []
         
         results = []
+        seen_keys = set()
         skipped_count = 0
         for price in prices_data.get("results", []):
             # Extract relevant data
@@ -133,30 +155,28 @@ def process_group_prices(category_path, group_id, date_val, existing_product_ids
                 skipped_count += 1
                 continue
                 
-            sub_type = price.get("subTypeName", "")
+            sub_type = price.get("subTypeName") or ""
+            
+            # Archives occasionally repeat a variant; keep the first occurrence
+            if (product_id, sub_type) in seen_keys:
+                continue
             
             # Use values directly from the JSON
             market_price = price.get("marketPrice")
-            direct_low = price.get("directLowPrice")
             low_price = price.get("lowPrice")
             mid_price = price.get("midPrice") 
             high_price = price.get("highPrice")
             
             # Skip if no useful price data
-            if all(p is None for p in [market_price, low_price, mid_price, high_price]):
+            if market_price is None and low_price is None and mid_price is None and high_price is None:
                 continue
                 
-            results.append({
-                "product_id": product_id,
-                "group_id": group_id,
-                "sub_type_name": sub_type,
-                "date": date_val,
-                "market_price": market_price,
-                "direct_low_price": direct_low,
-                "low_price": low_price,
-                "mid_price": mid_price,
-                "high_price": high_price
-            })
+            seen_keys.add((product_id, sub_type))
+            results.append((
+                product_id, sub_type,
+                low_price, high_price, mid_price,
+                market_price, price.get("directLowPrice")
+            ))
         
         if skipped_count > 0 and skipped_count > len(results):
             logging.info(f"Skipped {skipped_count} products not in database for group {group_id} on {date_val}")
@@ -166,57 +186,50 @@ def process_group_prices(category_path, group_id, date_val, existing_product_ids
         logging.error(f"Error processing price data for group {group_id} on {date_val}: {e}")
         return []
 
-def get_all_group_ids(conn):
-    """Get all group IDs from the database"""
+def get_all_group_ids(conn, category_id):
+    """Get all group IDs of a category from the database"""
     cursor = conn.cursor()
     try:
-        cursor.execute("SELECT group_id FROM groups")
+        cursor.execute("SELECT group_id FROM groups WHERE category_id = %s", (category_id,))
         return [row[0] for row in cursor.fetchall()]
     except Exception as e:
-        logging.error(f"Error getting group IDs: {e}")
+        logging.error(f"Error getting group IDs for category {category_id}: {e}")
         return []
     finally:
         cursor.close()
 
-def insert_daily_prices(conn, prices):
-    """Insert daily price records into the database"""
+def insert_group_prices(cursor, group_id, date_val, prices):
+    """Insert one group's price records for one date without committing.
+
+    The compact records from process_group_prices are screened by
+    screen_prices and go to insert_prices as-is; the per-group constants are
+    bound once for the whole statement. Quarantined rows are inserted but kept
+    out of the snapshot.
+    """
     if not prices:
         return 0
     
+    prices, quarantined = screen_prices(cursor, group_id, date_val, prices)
+    inserted = insert_prices(cursor, group_id, date_val, prices)
+    snapshot_rows = rows_in_effect(prices, inserted, date_val)
+    update_price_snapshot(cursor, [row for row in snapshot_rows if (row[0], row[1]) not in quarantined])
+    return len(inserted)
+
+def insert_daily_prices(conn, category_path, group_batch, date_val, existing_product_ids):
+    """Parse and insert a batch of groups for one date in a single transaction.
+
+    Groups are parsed and inserted one at a time so only a single group's
+    records are held in memory, however many groups the batch contains.
+    """
     cursor = conn.cursor()
     try:
-        values = []
-        for price in prices:
-            values.append((
-                price["product_id"],
-                price["group_id"],
-                price["sub_type_name"],
-                price["date"],
-                'daily',  # period_type
-                None,     # end_date (NULL for daily records)
-                None,     # open_price (NULL for daily as requested)
-                None,     # close_price (NULL for daily as requested)
-                price["low_price"],   # Direct from JSON
-                price["high_price"],  # Direct from JSON
-                price["mid_price"],   # Direct from JSON
-                price["market_price"],
-                price["direct_low_price"],
-                None  # volume (we don't have this information)
-            ))
+        inserted = 0
+        for group_id in group_batch:
+            group_prices = process_group_prices(category_path, group_id, date_val, existing_product_ids)
+            inserted += insert_group_prices(cursor, group_id, date_val, group_prices)
         
-        query = """
-            INSERT INTO price_history (
-                product_id, group_id, sub_type_name, date_point, period_type, end_date,
-                open_price, close_price, low_price, high_price, mid_price,
-                market_price, direct_low_price, volume
-            )
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            ON CONFLICT DO NOTHING
-        """
-        
-        execute_batch(cursor, query, values)
         conn.commit()
-        return len(values)
+        return inserted
     except Exception as e:
         conn.rollback()
         logging.error(f"Error inserting daily prices: {e}")
@@ -232,10 +245,43 @@ def cleanup():
     except Exception as e:
         logging.error(f"Error cleaning up: {e}")
 
+def process_category_date(pool, archive_path, category_id, group_ids, date_val, existing_product_ids):
+    """Load one category's prices for one date on its own pooled connection.
+
+    Errors stay inside the category so the other workers keep going.
+    """
+    prefix = f"[category {category_id}]"
+    category_path = os.path.join(archive_path, str(category_id))
+    if not os.path.isdir(category_path):
+        logging.warning(f"{prefix} No data in archive for {date_val}")
+        return 0
+    
+    conn = pool.getconn()
+    try:
+        # Commit in batches of groups; each group is parsed and inserted on its own
+        batch_size = 20
+        group_batches = [group_ids[j:j + batch_size] for j in range(0, len(group_ids), batch_size)]
+        
+        total_inserted = 0
+        for batch_idx, group_batch in enumerate(group_batches):
+            records_inserted = insert_daily_prices(conn, category_path, group_batch, date_val, existing_product_ids)
+            total_inserted += records_inserted
+            
+            if records_inserted > 0:
+                logging.info(f"{prefix} Batch {batch_idx+1}/{len(group_batches)}: Inserted {records_inserted} price records")
+        
+        return total_inserted
+    except Exception as e:
+        logging.error(f"{prefix} Error loading prices for {date_val}: {e}")
+        return 0
+    finally:
+        pool.putconn(conn)
+
 def main():
     """Main ETL process for historical price data"""
-    logging.info("Starting historical price ETL process")
+    logging.info(f"Starting historical price ETL process for categories {CATEGORY_IDS}")
     start_time = datetime.now()
+    pool = None
     
     try:
         # Define date range
@@ -245,16 +291,25 @@ def main():
         logging.info(f"Processing price data from {start_date} to {end_date}")
         
         # Connect to database
-        conn = psycopg2.connect(**DB_PARAMS)
+        workers = max(1, min(len(CATEGORY_IDS), MAX_CATEGORY_WORKERS))
+        pool = ThreadedConnectionPool(1, workers, **DB_PARAMS)
+        conn = pool.getconn()
         
-        # Get all group IDs
-        group_ids = get_all_group_ids(conn)
-        if not group_ids:
-            logging.error("No groups found in database. Please run the main ETL script first.")
+        # Get all group IDs per category
+        category_groups = {}
+        for category_id in CATEGORY_IDS:
+            group_ids = get_all_group_ids(conn, category_id)
+            if group_ids:
+                category_groups[category_id] = group_ids
+            else:
+                logging.error(f"[category {category_id}] No groups found in database. Please run the main ETL script first.")
+        if not category_groups:
             return
             
         # Get existing product IDs to filter out non-existent products
         existing_product_ids = get_existing_product_ids(conn)
+        ensure_snapshot_table(conn)
+        pool.putconn(conn)
         if not existing_product_ids:
             logging.error("No products found in database. Please run the main ETL script first.")
             return
@@ -263,45 +318,42 @@ def main():
         total_records = 0
         total_days = (end_date - start_date).days + 1
         
-        for i, single_date in enumerate(daterange_end_inclusive(start_date, end_date)):
-            date_str = single_date.strftime('%Y-%m-%d')
-            
-            # Progress reporting
-            progress = (i + 1) / total_days * 100
-            logging.info(f"Processing date: {date_str} ({i+1}/{total_days}, {progress:.1f}%)")
-            
-            # Download and extract archive
-            category_path = download_and_extract_archive(date_str)
-            if not category_path:
-                logging.warning(f"Skipping date {date_str} - could not download or extract archive")
-                continue
-            
-            # Process each group - using batch processing to conserve memory
-            batch_size = 20
-            group_batches = [group_ids[j:j + batch_size] for j in range(0, len(group_ids), batch_size)]
-            
-            for batch_idx, group_batch in enumerate(group_batches):
-                all_prices = []
-                for group_id in group_batch:
-                    group_prices = process_group_prices(category_path, group_id, single_date, existing_product_ids)
-                    all_prices.extend(group_prices)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for i, single_date in enumerate(daterange_end_inclusive(start_date, end_date)):
+                date_str = single_date.strftime('%Y-%m-%d')
                 
-                # Insert daily prices
-                records_inserted = insert_daily_prices(conn, all_prices)
-                total_records += records_inserted
+                # Progress reporting
+                progress = (i + 1) / total_days * 100
+                logging.info(f"Processing date: {date_str} ({i+1}/{total_days}, {progress:.1f}%)")
                 
-                if records_inserted > 0:
-                    logging.info(f"Batch {batch_idx+1}/{len(group_batches)}: Inserted {records_inserted} price records")
-            
-            # Clean up extracted files for this date
-            shutil.rmtree(os.path.join(TEMP_DIR, f"prices-{date_str}"), ignore_errors=True)
-            
-            # Report total progress periodically
-            if (i + 1) % 10 == 0 or i == total_days - 1:
-                logging.info(f"Total progress: {progress:.1f}% - Processed {total_records} records so far")
+                # Download and extract archive once for all categories
+                archive_path = download_and_extract_archive(date_str)
+                if not archive_path:
+                    logging.warning(f"Skipping date {date_str} - could not download or extract archive")
+                    continue
+                
+                futures = [
+                    executor.submit(process_category_date, pool, archive_path, category_id,
+                                    group_ids, single_date, existing_product_ids)
+                    for category_id, group_ids in category_groups.items()
+                ]
+                total_records += sum(future.result() for future in futures)
+                
+                # Clean up extracted files for this date
+                shutil.rmtree(os.path.join(TEMP_DIR, f"prices-{date_str}"), ignore_errors=True)
+                
+                # Report total progress periodically
+                if (i + 1) % 10 == 0 or i == total_days - 1:
+                    logging.info(f"Total progress: {progress:.1f}% - Processed {total_records} records so far")
         
-        # Close database connection
-        conn.close()
+        # Bring the on-disk price cube up to date with the loaded days
+        conn = pool.getconn()
+        try:
+            update_price_cube(conn, since=start_date)
+        except Exception as e:
+            logging.error(f"Error updating price cube: {e}")
+        finally:
+            pool.putconn(conn)
         
         # Final cleanup
         cleanup()
@@ -312,6 +364,10 @@ def main():
         
     except Exception as e:
         logging.error(f"Historical price ETL process failed: {e}")
+    finally:
+        # Close database connections, also on the early returns
+        if pool is not None:
+            pool.closeall()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""Shared helpers for the batch stages that work on price_history as a whole.
+
+Everything here moves data with COPY instead of row-by-row fetches and keeps the
+frames in compact dtypes, so a full pass over ~30k variants x 500+ days fits in
+memory and takes seconds rather than minutes.
+"""
+
+import io
+import tempfile
+import numpy as np
+import pandas as pd
+
+from price_storage import NOT_QUARANTINED_SQL
+
+KEY_COLUMNS = ["product_id", "sub_type_name"]
+PRICE_COLUMNS = ["low_price", "high_price", "mid_price", "market_price", "direct_low_price"]
+
+def load_price_history(conn, columns=("market_price",), start_date=None, end_date=None,
+                       product_ids=None, extra_columns=(), seed_start=False):
+    """Load daily price_history rows into a long DataFrame.
+
+    Returns product_id, sub_type_name, date_point plus the requested price
+    columns (float32) and any extra_columns (e.g. group_id). Rows where every
+    requested price column is NULL, and rows held in price_quarantine, are
+    dropped in the database.
+
+    With seed_start, each variant's row on start_date is its row in effect
+    then (the latest one on or before it), so a window that starts after a
+    card's last change or in a gap still opens with its price.
+    """
+    columns = list(columns)
+    select_columns = KEY_COLUMNS + ["date_point"] + list(extra_columns) + columns
+    conditions = ["period_type = 'daily'", NOT_QUARANTINED_SQL.format(alias="price_history")]
+    params = []
+
+    if columns:
+        conditions.append("(" + " OR ".join(f"{c} IS NOT NULL" for c in columns) + ")")
+    if end_date is not None:
+        conditions.append("date_point <= %s")
+        params.append(end_date)
+    if product_ids is not None:
+        conditions.append("product_id = ANY(%s)")
+        params.append(list(product_ids))
+
+    seeded = seed_start and start_date is not None
+    range_conditions, range_params = list(conditions), list(params)
+    if start_date is not None:
+        range_conditions.append("date_point > %s" if seeded else "date_point >= %s")
+        range_params.append(start_date)
+
+    cursor = conn.cursor()
+    try:
+        query = cursor.mogrify(f"""
+            SELECT {', '.join(select_columns)}
+            FROM price_history
+            WHERE {' AND '.join(range_conditions)}
+        """, range_params).decode()
+        if seeded:
+            seed_columns = ["%s::date AS date_point" if c == "date_point" else c for c in select_columns]
+            seed_query = cursor.mogrify(f"""
+                SELECT DISTINCT ON (product_id, sub_type_name) {', '.join(seed_columns)}
+                FROM price_history
+                WHERE {' AND '.join(conditions)} AND date_point <= %s
+                ORDER BY product_id, sub_type_name, date_point DESC
+            """, [start_date] + params + [start_date]).decode()
+            query = f"({seed_query}) UNION ALL ({query})"
+
+        # Spool to a temp file so large histories do not sit in memory twice
+        with tempfile.TemporaryFile(mode="w+") as buf:
+            cursor.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER)", buf)
+            buf.seek(0)
+            dtypes = {"product_id": np.int32, "sub_type_name": "category"}
+            dtypes.update({c: np.float32 for c in columns})
+            dtypes.update({c: np.int32 for c in extra_columns if c.endswith("_id")})
+            df = pd.read_csv(buf, dtype=dtypes, parse_dates=["date_point"],
+                             keep_default_na=False, na_values={c: [""] for c in columns})
+    finally:
+        cursor.close()
+
+    return df
+
+def get_last_loaded_date(conn):
+    """Latest date_point in price_history, or None when it is empty.
+
+    Stages that fill forward end their range here rather than at today, so a
+    run before the day's load does not store a filled-in day that is never
+    recomputed.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT MAX(date_point) FROM price_history WHERE period_type = 'daily'")
+        return cursor.fetchone()[0]
+    finally:
+        cursor.close()
+
+def pivot_daily(df, value="market_price", start_date=None, end_date=None, ffill_limit=None):
+    """Pivot a long history frame into a (day x variant) float32 matrix.
+
+    The index is a gap-free daily calendar and the columns are a
+    (product_id, sub_type_name) MultiIndex. Missing days are forward filled,
+    optionally limited to ffill_limit days (pass 0 to keep the gaps as NaN).
+    An unlimited fill is what gives change-only histories (PRICE_STORAGE_MODE
+    =changes) their "valid until the next row" meaning.
+    """
+    if df.empty:
+        return pd.DataFrame(dtype=np.float32)
+
+    df = df[df[value].notna()]
+
+    # Scatter straight into a preallocated array; DataFrame.pivot on ~15M rows
+    # with a MultiIndex is an order of magnitude slower
+    sub_types = df["sub_type_name"].astype("category")
+    sub_type_names = np.asarray(sub_types.cat.categories, dtype=object)
+    n_sub_types = len(sub_type_names)
+    combined = df["product_id"].values.astype(np.int64) * n_sub_types + sub_types.cat.codes.values
+    variant_codes, variant_keys = pd.factorize(combined, sort=True)
+    variants = pd.MultiIndex.from_arrays(
+        [variant_keys // n_sub_types, sub_type_names[variant_keys % n_sub_types]],
+        names=KEY_COLUMNS
+    )
+
+    dates = df["date_point"].values.astype("datetime64[D]")
+    start = np.datetime64(start_date, "D") if start_date is not None else dates.min()
+    end = np.datetime64(end_date, "D") if end_date is not None else dates.max()
+    day_codes = (dates - start).astype(np.int64)
+    in_range = (day_codes >= 0) & (dates <= end)
+
+    matrix = np.full((int((end - start).astype(np.int64)) + 1, len(variants)), np.nan, dtype=np.float32)
+    # Later rows win, matching drop_duplicates(keep="last")
+    matrix[day_codes[in_range], variant_codes[in_range]] = df[value].values[in_range]
+
+    wide = pd.DataFrame(matrix, index=pd.date_range(start, end, freq="D"), columns=variants)
+    if ffill_limit != 0:
+        wide = wide.ffill(limit=ffill_limit)
+
+    return wide
+
+def copy_dataframe(cursor, df, table, columns=None):
+    """COPY a DataFrame into a table, writing NaN/None as NULL"""
+    columns = list(columns or df.columns)
+    buf = io.StringIO()
+    df[columns].to_csv(buf, index=False, header=False, na_rep="")
+    buf.seek(0)
+    cursor.copy_expert(
+        f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, NULL '')",
+        buf
+    )
+    return len(df)
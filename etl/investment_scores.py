@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+
+import psycopg2
+import numpy as np
+import pandas as pd
+import logging
+from datetime import date
+import os
+import time
+from dotenv import load_dotenv
+
+from history_frame import copy_dataframe
+from job_lock import run_locked
+from price_storage import NOT_QUARANTINED_SQL
+from price_validation import ensure_quarantine_table
+
+# Load environment variables
+load_dotenv()
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+    handlers=[
+        logging.FileHandler("investment_scores.log"),
+        logging.StreamHandler()
+    ]
+)
+
+# Database connection parameters
+DB_PARAMS = {
+    "host": os.getenv("DB_HOST", "localhost"),
+    "database": os.getenv("DB_NAME", "pokemon_tcg"),
+    "user": os.getenv("DB_USER", "postgres"),
+    "password": os.getenv("DB_PASSWORD", ""),
+    "port": os.getenv("DB_PORT", "5432")
+}
+
+SCORE_MIN_PRICE = float(os.getenv("SCORE_MIN_PRICE", "1.00"))  # Same penny-card cut as the leaderboards
+
+# Blend of the price_change timeframes into one momentum figure; timeframes a
+# variant has no value for are left out and the remaining weights rescaled
+MOMENTUM_WEIGHTS = {'7d': 0.10, '30d': 0.30, '6m': 0.35, '1y': 0.25}
+
+# Weights of the components in the final score. Every component is a
+# percentile in [0, 1] across all scored variants (1 = most attractive); a
+# missing input scores a neutral 0.5
+COMPONENT_WEIGHTS = {
+    "momentum_score": 0.40,
+    "volatility_score": 0.20,
+    "liquidity_score": 0.25,
+    "age_score": 0.15,
+}
+
+SCORE_COLUMNS = [
+    "product_id", "sub_type_name", "rank", "score",
+    "momentum_score", "volatility_score", "liquidity_score", "age_score",
+    "current_price", "momentum_pct", "volatility_30d", "spread_pct", "set_age_days",
+    "as_of_date"
+]
+
+def ensure_scores_table(conn):
+    """Create the investment_scores table if it does not exist yet"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS investment_scores (
+                product_id        INTEGER      NOT NULL,
+                sub_type_name     VARCHAR(100) NOT NULL,
+                rank              INTEGER      NOT NULL,
+                score             REAL         NOT NULL,
+                momentum_score    REAL         NOT NULL,
+                volatility_score  REAL         NOT NULL,
+                liquidity_score   REAL         NOT NULL,
+                age_score         REAL         NOT NULL,
+                current_price     REAL         NOT NULL,
+                momentum_pct      REAL,
+                volatility_30d    REAL,
+                spread_pct        REAL,
+                set_age_days      INTEGER,
+                as_of_date        DATE         NOT NULL,
+                PRIMARY KEY (product_id, sub_type_name)
+            )
+        """)
+        # Pages are read by rank, so "next page" is an index range scan
+        cursor.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_investment_scores_rank
+            ON investment_scores (rank)
+        """)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logging.error(f"Error creating investment_scores table: {e}")
+        raise
+    finally:
+        cursor.close()
+
+def load_score_inputs(conn, min_price=SCORE_MIN_PRICE):
+    """One row per priced variant with everything the score needs.
+
+    Momentum comes from price_change_variant, volatility from price_indicators
+    (NULL when technical_indicators.py has not run), the latest low/mid/market
+    prices from the row in effect on the snapshot's latest date (the last
+    non-held row on or before it, as change-only rows rarely fall on it), and the
+    set age from the group's release date (groups.published_on, filled by the
+    daily ETL). The first tracked price is no substitute: tracking only starts
+    in 2024-02, so every older set would get the same age. Groups without a
+    release date get a NULL age and a neutral age score.
+    """
+    momentum_columns = ",\n                    ".join(
+        f"MAX(change_pct) FILTER (WHERE timeframe = '{timeframe}') AS change_{timeframe}_pct"
+        for timeframe in MOMENTUM_WEIGHTS
+    )
+
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT to_regclass('price_indicators')")
+        volatility_sql = "i.volatility_30d" if cursor.fetchone()[0] is not None else "NULL::real"
+        indicators_join = (
+            "LEFT JOIN price_indicators i ON i.product_id = m.product_id AND i.sub_type_name = m.sub_type_name"
+            if volatility_sql != "NULL::real" else ""
+        )
+
+        cursor.execute("""
+            SELECT 1 FROM information_schema.columns
+            WHERE table_name = 'groups' AND column_name = 'published_on'
+        """)
+        set_age_sql = "CURRENT_DATE - g.published_on" if cursor.fetchone() else "NULL::integer"
+
+        cursor.execute(f"""
+            WITH momentum AS (
+                SELECT
+                    product_id, sub_type_name,
+                    MAX(current_price) AS current_price,
+                    {momentum_columns}
+                FROM price_change_variant
+                GROUP BY product_id, sub_type_name
+            )
+            SELECT
+                m.*,
+                {volatility_sql} AS volatility_30d,
+                ph.low_price, ph.mid_price, ph.market_price,
+                {set_age_sql} AS set_age_days
+            FROM momentum m
+            JOIN products p ON p.product_id = m.product_id
+            JOIN price_snapshot s ON s.product_id = m.product_id AND s.sub_type_name = m.sub_type_name
+            LEFT JOIN LATERAL (
+                SELECT low_price, mid_price, market_price
+                FROM price_history ph
+                WHERE ph.product_id = m.product_id AND ph.sub_type_name = m.sub_type_name
+                  AND ph.period_type = 'daily' AND ph.date_point <= s.latest_date
+                  AND ph.market_price IS NOT NULL
+                  AND {NOT_QUARANTINED_SQL.format(alias="ph")}
+                ORDER BY ph.date_point DESC
+                LIMIT 1
+            ) ph ON TRUE
+            {indicators_join}
+            LEFT JOIN groups g ON g.group_id = p.group_id
+            WHERE m.current_price >= %s
+        """, (min_price,))
+        columns = [desc[0] for desc in cursor.description]
+        inputs = pd.DataFrame(cursor.fetchall(), columns=columns)
+    finally:
+        cursor.close()
+
+    numeric = [c for c in columns if c not in ("product_id", "sub_type_name")]
+    inputs[numeric] = inputs[numeric].astype(np.float64)
+    return inputs
+
+def percentile(values, higher_is_better=True):
+    """Cross-sectional percentile in [0, 1]; NaN inputs score a neutral 0.5"""
+    ranks = values.rank(pct=True, ascending=higher_is_better)
+    return ranks.fillna(0.5)
+
+def compute_scores(inputs, as_of):
+    """Score and rank every variant in one vectorized pass.
+
+    Components (each a percentile across all variants):
+      momentum    weighted blend of the 7d/30d/6m/1y percent changes, higher is better
+      volatility  30-day volatility of daily returns, lower is better
+      liquidity   spread_pct = ((mid - low) + |market - mid|) / market, tighter is better
+      age         days since the set's release date, older is better
+
+    Ties are broken by product_id and sub_type_name so reruns give the same order.
+    """
+    weights = np.array(list(MOMENTUM_WEIGHTS.values()))
+    changes = inputs[[f"change_{timeframe}_pct" for timeframe in MOMENTUM_WEIGHTS]].values
+    available = ~np.isnan(changes)
+    weight_sum = (available * weights).sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        momentum_pct = np.where(weight_sum > 0, np.nansum(changes * weights, axis=1) / weight_sum, np.nan)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        spread_pct = (
+            (inputs["mid_price"] - inputs["low_price"]) + (inputs["market_price"] - inputs["mid_price"]).abs()
+        ) / inputs["market_price"] * 100
+    spread_pct = spread_pct.where(inputs["market_price"] > 0)
+
+    scores = pd.DataFrame({
+        "product_id": inputs["product_id"].values,
+        "sub_type_name": inputs["sub_type_name"].values,
+        "current_price": inputs["current_price"].values,
+        "momentum_pct": momentum_pct,
+        "volatility_30d": inputs["volatility_30d"].values,
+        "spread_pct": spread_pct.values,
+        "set_age_days": inputs["set_age_days"].values,
+    })
+    scores["momentum_score"] = percentile(scores["momentum_pct"])
+    scores["volatility_score"] = percentile(scores["volatility_30d"], higher_is_better=False)
+    scores["liquidity_score"] = percentile(scores["spread_pct"], higher_is_better=False)
+    scores["age_score"] = percentile(scores["set_age_days"])
+
+    scores["score"] = sum(scores[component] * weight for component, weight in COMPONENT_WEIGHTS.items()) * 100
+    scores = scores.sort_values(
+        ["score", "product_id", "sub_type_name"], ascending=[False, True, True], kind="mergesort"
+    )
+    scores["rank"] = np.arange(1, len(scores) + 1)
+    scores["set_age_days"] = scores["set_age_days"].astype("Int64")
+    scores["as_of_date"] = as_of
+
+    for column in ["score", "momentum_score", "volatility_score", "liquidity_score", "age_score"]:
+        scores[column] = scores[column].round(4)
+    for column in ["current_price", "momentum_pct", "volatility_30d", "spread_pct"]:
+        scores[column] = scores[column].round(2)
+
+    return scores[SCORE_COLUMNS]
+
+def store_scores(conn, scores):
+    """Replace the contents of investment_scores in one transaction"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("DELETE FROM investment_scores")
+        copied = copy_dataframe(cursor, scores, "investment_scores", SCORE_COLUMNS)
+        conn.commit()
+        return copied
+    except Exception as e:
+        conn.rollback()
+        logging.error(f"Error storing investment scores: {e}")
+        return 0
+    finally:
+        cursor.close()
+
+def main():
+    """Score every product/sub-type for investment; run after price_changes.py.
+
+    Returns True when the run completed.
+    """
+    logging.info("Starting investment score calculation")
+    start_time = time.time()
+
+    try:
+        conn = psycopg2.connect(**DB_PARAMS)
+        ensure_scores_table(conn)
+        ensure_quarantine_table(conn)  # The latest prices skip held rows
+
+        load_start = time.time()
+        inputs = load_score_inputs(conn)
+        logging.info(f"Loaded inputs for {len(inputs)} variants in {time.time() - load_start:.2f} seconds")
+        if inputs.empty:
+            logging.info("No priced variants to score")
+            return True
+
+        scores = compute_scores(inputs, date.today())
+        stored = store_scores(conn, scores)
+        conn.close()
+
+        duration = time.time() - start_time
+        logging.info(f"Investment score calculation completed in {duration:.2f} seconds, stored {stored} variants")
+        return stored > 0
+
+    except Exception as e:
+        logging.error(f"Investment score calculation failed: {e}")
+        return False
+
+if __name__ == "__main__":
+    run_locked("investment_scores", main)
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""Postgres advisory locks that keep each ETL job to a single running instance.
+
+The lock is a session-level pg_try_advisory_lock held on a dedicated
+connection for as long as the job runs, so it is released automatically if
+the process dies. Cron-launched scripts and the scheduler daemon take the same
+lock for the same job name.
+"""
+
+import psycopg2
+import logging
+import zlib
+from contextlib import contextmanager
+import os
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Database connection parameters
+DB_PARAMS = {
+    "host": os.getenv("DB_HOST", "localhost"),
+    "database": os.getenv("DB_NAME", "pokemon_tcg"),
+    "user": os.getenv("DB_USER", "postgres"),
+    "password": os.getenv("DB_PASSWORD", ""),
+    "port": os.getenv("DB_PORT", "5432")
+}
+
+# First half of the two-int advisory lock key ("PKMN"), so these locks cannot
+# collide with advisory locks taken by anything else in the database
+LOCK_NAMESPACE = 0x504B4D4E
+
+def lock_key(job_name):
+    """Stable 31-bit key for a job name"""
+    return zlib.crc32(job_name.encode()) & 0x7FFFFFFF
+
+@contextmanager
+def job_lock(job_name):
+    """Try to take the job's advisory lock without waiting.
+
+    Yields True when this process now holds the lock and False when another
+    instance of the job is running; the lock is released on exit.
+    """
+    conn = psycopg2.connect(application_name=f"etl-lock:{job_name}", **DB_PARAMS)
+    conn.autocommit = True
+    cursor = conn.cursor()
+    acquired = False
+    try:
+        cursor.execute("SELECT pg_try_advisory_lock(%s, %s)", (LOCK_NAMESPACE, lock_key(job_name)))
+        acquired = cursor.fetchone()[0]
+        if not acquired:
+            logging.warning(f"Job '{job_name}' is already running elsewhere, skipping")
+        yield acquired
+    finally:
+        if acquired:
+            cursor.execute("SELECT pg_advisory_unlock(%s, %s)", (LOCK_NAMESPACE, lock_key(job_name)))
+        cursor.close()
+        conn.close()
+
+def run_locked(job_name, job):
+    """Run job() while holding the job's lock; returns its result, or None if locked out"""
+    with job_lock(job_name) as acquired:
+        if not acquired:
+            return None
+        return job()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+
+import psycopg2
+import logging
+import sys
+from datetime import datetime
+import os
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+    handlers=[
+        logging.FileHandler("migrations.log"),
+        logging.StreamHandler()
+    ]
+)
+
+# Database connection parameters
+DB_PARAMS = {
+    "host": os.getenv("DB_HOST", "localhost"),
+    "database": os.getenv("DB_NAME", "pokemon_tcg"),
+    "user": os.getenv("DB_USER", "postgres"),
+    "password": os.getenv("DB_PASSWORD", ""),
+    "port": os.getenv("DB_PORT", "5432")
+}
+
+UNIQUE_INDEX_NAME = "uq_price_history_natural_key"
+
+def normalize_sub_type_names(conn):
+    """Replace NULL sub_type_name with '' so NULLs cannot slip past the unique index"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("UPDATE price_history SET sub_type_name = '' WHERE sub_type_name IS NULL")
+        updated = cursor.rowcount
+        cursor.execute("ALTER TABLE price_history ALTER COLUMN sub_type_name SET DEFAULT ''")
+        cursor.execute("ALTER TABLE price_history ALTER COLUMN sub_type_name SET NOT NULL")
+        conn.commit()
+        logging.info(f"Normalized {updated} NULL sub_type_name values")
+    except Exception as e:
+        conn.rollback()
+        logging.error(f"Error normalizing sub_type_name: {e}")
+        raise
+    finally:
+        cursor.close()
+
+def count_duplicates(conn):
+    """Count rows that share a natural key with an earlier row"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT COALESCE(SUM(cnt - 1), 0)
+            FROM (
+                SELECT COUNT(*) AS cnt
+                FROM price_history
+                GROUP BY product_id, sub_type_name, date_point, period_type
+                HAVING COUNT(*) > 1
+            ) dupes
+        """)
+        duplicates = cursor.fetchone()[0]
+        # End the read's transaction so create_unique_index can switch to autocommit
+        conn.commit()
+        return duplicates
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+def delete_duplicates(conn):
+    """Delete every duplicate in one set-based statement, keeping the first inserted row"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            DELETE FROM price_history ph
+            USING (
+                SELECT id
+                FROM (
+                    SELECT
+                        id,
+                        ROW_NUMBER() OVER (
+                            PARTITION BY product_id, sub_type_name, date_point, period_type
+                            ORDER BY id
+                        ) AS rn
+                    FROM price_history
+                ) ranked
+                WHERE rn > 1
+            ) dupes
+            WHERE ph.id = dupes.id
+        """)
+        deleted = cursor.rowcount
+        conn.commit()
+        logging.info(f"Deleted {deleted} duplicate price_history rows")
+        return deleted
+    except Exception as e:
+        conn.rollback()
+        logging.error(f"Error deleting duplicates: {e}")
+        raise
+    finally:
+        cursor.close()
+
+def create_unique_index(conn):
+    """Create the natural-key unique index without blocking the ETL writers"""
+    old_autocommit = conn.autocommit
+    conn.autocommit = True  # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    cursor = conn.cursor()
+    try:
+        # A failed concurrent build leaves an INVALID index behind; drop it and retry
+        cursor.execute("""
+            SELECT i.indisvalid
+            FROM pg_index i
+            JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE c.relname = %s
+        """, (UNIQUE_INDEX_NAME,))
+        row = cursor.fetchone()
+        if row and row[0]:
+            logging.info(f"Unique index {UNIQUE_INDEX_NAME} already exists")
+            return
+        if row:
+            logging.warning(f"Dropping invalid index {UNIQUE_INDEX_NAME} left by an earlier run")
+            cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {UNIQUE_INDEX_NAME}")
+
+        cursor.execute(f"""
+            CREATE UNIQUE INDEX CONCURRENTLY {UNIQUE_INDEX_NAME}
+            ON price_history (product_id, sub_type_name, date_point, period_type)
+        """)
+        logging.info(f"Created unique index {UNIQUE_INDEX_NAME}")
+    finally:
+        cursor.close()
+        conn.autocommit = old_autocommit
+
+def main():
+    """Add the (product_id, sub_type_name, date_point, period_type) unique index to price_history"""
+    logging.info("Starting price_history natural-key migration")
+    start_time = datetime.now()
+
+    try:
+        conn = psycopg2.connect(**DB_PARAMS)
+
+        normalize_sub_type_names(conn)
+
+        duplicates = count_duplicates(conn)
+        logging.info(f"Found {duplicates} duplicate price_history rows")
+        if duplicates:
+            delete_duplicates(conn)
+
+        create_unique_index(conn)
+
+        # Reclaim the space of the deleted rows and refresh planner statistics
+        conn.autocommit = True
+        cursor = conn.cursor()
+        cursor.execute("VACUUM ANALYZE price_history")
+        cursor.close()
+
+        conn.close()
+
+        duration = (datetime.now() - start_time).total_seconds()
+        logging.info(f"Migration completed in {duration:.2f} seconds")
+
+    except Exception as e:
+        logging.error(f"Migration failed: {e}")
+        # The loaders' ON CONFLICT needs the index; make the failure visible to callers
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+
+import psycopg2
+import numpy as np
+import pandas as pd
+import argparse
+import logging
+from datetime import date, timedelta
+import os
+import time
+from dotenv import load_dotenv
+
+from history_frame import load_price_history, get_last_loaded_date, pivot_daily, copy_dataframe
+from price_snapshot import ensure_snapshot_table
+
+# Load environment variables
+load_dotenv()
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+    handlers=[
+        logging.FileHandler("price_change_history.log"),
+        logging.StreamHandler()
+    ]
+)
+
+# Database connection parameters
+DB_PARAMS = {
+    "host": os.getenv("DB_HOST", "localhost"),
+    "database": os.getenv("DB_NAME", "pokemon_tcg"),
+    "user": os.getenv("DB_USER", "postgres"),
+    "password": os.getenv("DB_PASSWORD", ""),
+    "port": os.getenv("DB_PORT", "5432")
+}
+
+# Fixed-length lookbacks, matching the target dates used by price_changes.py;
+# 'ytd' and 'all' are handled separately
+LOOKBACK_DAYS = {'7d': 7, '30d': 30, '6m': 180, '1y': 365}
+TIMEFRAMES = ['7d', '30d', '6m', 'ytd', '1y', 'all']
+DAYS_PER_CHUNK = 30  # Output days written per transaction
+
+SNAPSHOT_COLUMNS = ["snapshot_date", "product_id", "sub_type_name", "current_price"] + [
+    f"change_{timeframe}_{kind}" for timeframe in TIMEFRAMES for kind in ("pct", "dollar")
+]
+
+def ensure_history_table(conn):
+    """Create the price_change_daily table if it does not exist yet"""
+    columns = ",\n".join(
+        f"                change_{timeframe}_{kind} REAL"
+        for timeframe in TIMEFRAMES for kind in ("pct", "dollar")
+    )
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS price_change_daily (
+                snapshot_date  DATE         NOT NULL,
+                product_id     INTEGER      NOT NULL,
+                sub_type_name  VARCHAR(100) NOT NULL,
+                current_price  REAL         NOT NULL,
+{columns},
+                PRIMARY KEY (snapshot_date, product_id, sub_type_name)
+            )
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_price_change_daily_product
+            ON price_change_daily (product_id, sub_type_name, snapshot_date)
+        """)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logging.error(f"Error creating price_change_daily table: {e}")
+        raise
+    finally:
+        cursor.close()
+
+def get_default_range(conn):
+    """Continue after the last stored snapshot, or start at the first price ever seen.
+
+    The range ends at the last loaded day rather than today, so a run before
+    the daily load does not store a filled-in day that is never recomputed.
+    """
+    last_loaded = get_last_loaded_date(conn)
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT MAX(snapshot_date) FROM price_change_daily")
+        last_snapshot = cursor.fetchone()[0]
+        if last_snapshot is not None:
+            return last_snapshot + timedelta(days=1), last_loaded
+        cursor.execute("SELECT MIN(first_date) FROM price_snapshot")
+        first_date = cursor.fetchone()[0]
+        return first_date, last_loaded
+    finally:
+        cursor.close()
+
+def load_first_prices(conn, variants):
+    """First observed price and date for each variant column, from price_snapshot"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT product_id, sub_type_name, first_price, first_date FROM price_snapshot")
+        snapshot = pd.DataFrame(cursor.fetchall(), columns=["product_id", "sub_type_name", "first_price", "first_date"])
+    finally:
+        cursor.close()
+    snapshot = snapshot.set_index(["product_id", "sub_type_name"]).reindex(variants)
+    first_price = snapshot["first_price"].astype(np.float32).values
+    first_date = pd.to_datetime(snapshot["first_date"]).values.astype("datetime64[D]")
+    return first_price, first_date
+
+def percent_change(ref, current):
+    """Vectorized calculate_percent_change: NaN where the reference is missing or zero"""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pct = np.where(ref != 0, (current - ref) / ref * 100, np.nan)
+    return np.round(pct, 2)
+
+def compute_snapshots(filled, first_price, first_date, output_dates):
+    """Compute every price_change metric for every variant on every output date.
+
+    filled is the forward-filled (day x variant) matrix, starting at least a
+    year before the first output date. Each timeframe's reference price is the
+    same matrix shifted by its lookback, so one pass over the sorted history
+    yields all days at once. Returns a long DataFrame in SNAPSHOT_COLUMNS order.
+    """
+    values = filled.values
+    first_day = filled.index[0]
+    positions = np.array([(pd.Timestamp(d) - first_day).days for d in output_dates])
+    current = values[positions]
+
+    metrics = {}
+    for timeframe in TIMEFRAMES:
+        if timeframe in LOOKBACK_DAYS:
+            ref_positions = positions - LOOKBACK_DAYS[timeframe]
+            ref = np.where((ref_positions >= 0)[:, None], values[np.maximum(ref_positions, 0)], np.nan)
+        elif timeframe == 'ytd':
+            ref_positions = np.array([(pd.Timestamp(d.year, 1, 1) - first_day).days for d in output_dates])
+            ref = np.where((ref_positions >= 0)[:, None], values[np.maximum(ref_positions, 0)], np.nan)
+        else:
+            # All-time: the first price ever, once it has been observed
+            observed = first_date[None, :] <= np.array(output_dates, dtype="datetime64[D]")[:, None]
+            ref = np.where(observed, first_price[None, :], np.nan)
+
+        metrics[f"change_{timeframe}_pct"] = percent_change(ref, current)
+        metrics[f"change_{timeframe}_dollar"] = np.round(current - ref, 2)
+
+    # Only emit rows for variants that had a price on that day
+    day_idx, variant_idx = np.nonzero(~np.isnan(current))
+    result = pd.DataFrame({
+        "snapshot_date": np.array(output_dates, dtype="datetime64[D]")[day_idx],
+        "product_id": filled.columns.get_level_values(0).values[variant_idx],
+        "sub_type_name": filled.columns.get_level_values(1).values[variant_idx],
+        "current_price": np.round(current[day_idx, variant_idx], 2),
+    })
+    for name, matrix in metrics.items():
+        result[name] = matrix[day_idx, variant_idx]
+    return result[SNAPSHOT_COLUMNS]
+
+def store_snapshots(conn, snapshots, chunk_start, chunk_end):
+    """Replace the snapshots of a date range in one transaction"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "DELETE FROM price_change_daily WHERE snapshot_date BETWEEN %s AND %s",
+            (chunk_start, chunk_end)
+        )
+        copied = copy_dataframe(cursor, snapshots, "price_change_daily", SNAPSHOT_COLUMNS)
+        conn.commit()
+        return copied
+    except Exception as e:
+        conn.rollback()
+        logging.error(f"Error storing snapshots for {chunk_start} to {chunk_end}: {e}")
+        return 0
+    finally:
+        cursor.close()
+
+def main():
+    """Backfill or extend daily price_change snapshots over a date range"""
+    parser = argparse.ArgumentParser(description="Compute price_change metrics for every day in a range")
+    parser.add_argument("--start", type=date.fromisoformat, help="first snapshot date (default: day after the last stored one)")
+    parser.add_argument("--end", type=date.fromisoformat, help="last snapshot date (default and latest: the last loaded day)")
+    args = parser.parse_args()
+
+    logging.info("Starting price change history calculation")
+    start_time = time.time()
+
+    try:
+        conn = psycopg2.connect(**DB_PARAMS)
+        ensure_snapshot_table(conn)
+        ensure_history_table(conn)
+
+        default_start, default_end = get_default_range(conn)
+        start = args.start or default_start
+        end = min(args.end, default_end) if args.end and default_end else default_end
+        if start is None or end is None or start > end:
+            logging.info("Snapshots are already up to date")
+            return
+        logging.info(f"Computing snapshots from {start} to {end}")
+
+        # Enough history before the first output day for the longest lookback and YTD,
+        # opened with each variant's price in effect on load_start, as price_changes.py
+        # would read it, so a gap or a change-only row before the window is not lost
+        load_start = min(start - timedelta(days=max(LOOKBACK_DAYS.values())), date(start.year, 1, 1))
+        history = load_price_history(conn, columns=["market_price"], start_date=load_start, end_date=end,
+                                     seed_start=True)
+        filled = pivot_daily(history, "market_price", start_date=load_start, end_date=end)
+        del history
+        if filled.empty:
+            logging.info("No price history in range")
+            return
+        logging.info(f"Built price matrix of {filled.shape[0]} days x {filled.shape[1]} variants")
+
+        first_price, first_date = load_first_prices(conn, filled.columns)
+
+        total_rows = 0
+        output_dates = [start + timedelta(days=n) for n in range((end - start).days + 1)]
+        for offset in range(0, len(output_dates), DAYS_PER_CHUNK):
+            chunk = output_dates[offset:offset + DAYS_PER_CHUNK]
+            snapshots = compute_snapshots(filled, first_price, first_date, chunk)
+            total_rows += store_snapshots(conn, snapshots, chunk[0], chunk[-1])
+            logging.info(f"Stored snapshots for {chunk[0]} to {chunk[-1]} ({len(snapshots)} rows)")
+
+        conn.close()
+
+        duration = time.time() - start_time
+        logging.info(f"Price change history completed in {duration:.2f} seconds, stored {total_rows} rows")
+
+    except Exception as e:
+        logging.error(f"Price change history calculation failed: {e}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""Settings and SQL of price_changes.py that other scripts reuse.
+
+Importing this module only reads the environment: no log file is opened and
+an unknown timeframe does not raise (price_changes.py checks them), so
+test_db_connection.py can EXPLAIN the exact statements a run executes.
+"""
+
+import os
+import re
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Comma separated timeframes to compute: <n>d, <n>w, <n>m (30 days), <n>y (365
+# days), 'ytd' (since Jan 1) and 'all' (since the first recorded price)
+TIMEFRAMES = [t.strip() for t in os.getenv("PRICE_CHANGE_TIMEFRAMES", "7d,30d,6m,ytd,1y,all").split(",") if t.strip()]
+TIMEFRAME_PATTERN = re.compile(r"^(\d+)([dwmy])$")
+TIMEFRAME_UNIT_DAYS = {'d': 1, 'w': 7, 'm': 30, 'y': 365}
+
+# Leaderboard configuration
+LEADERBOARD_SIZE = int(os.getenv("LEADERBOARD_SIZE", "15"))
+LEADERBOARD_MIN_PRICE = float(os.getenv("LEADERBOARD_MIN_PRICE", "1.00"))  # Drops penny-card noise
+LEADERBOARD_TIMEFRAMES = TIMEFRAMES
+LEADERBOARD_ALL_SUB_TYPES = 'all'
+
+# Current and all-time prices of a batch of products, read from the ETL-maintained snapshot
+SNAPSHOT_PRICES_QUERY = """
+    SELECT product_id, sub_type_name, latest_price, latest_date, first_price, first_date
+    FROM price_snapshot
+    WHERE product_id = ANY(%s)
+"""
+
+def is_valid_timeframe(timeframe):
+    """Whether a PRICE_CHANGE_TIMEFRAMES entry is one price_changes.py understands"""
+    return timeframe in ('ytd', 'all') or TIMEFRAME_PATTERN.match(timeframe) is not None
+
+def build_leaderboard_query(timeframes):
+    """SQL that ranks price_change_variant into leaderboard rows for the given timeframes.
+
+    Takes %(min_price)s, %(size)s and %(all_sub_types)s parameters. The
+    timeframes are inlined, so only pass validated ones.
+    """
+    timeframes = ", ".join(f"'{timeframe}'" for timeframe in timeframes)
+    
+    return f"""
+            WITH variants AS (
+                SELECT product_id, sub_type_name, timeframe, current_price, change_pct, change_dollar
+                FROM price_change_variant
+                WHERE current_price >= %(min_price)s
+                  AND timeframe IN ({timeframes})
+            ),
+            metrics AS (
+                SELECT DISTINCT ON (product_id, sub_type_name)
+                    product_id, sub_type_name, current_price,
+                    'current' AS timeframe, 'price' AS metric, current_price AS value
+                FROM variants
+                UNION ALL
+                SELECT product_id, sub_type_name, current_price, timeframe, 'dollar', change_dollar
+                FROM variants WHERE change_dollar IS NOT NULL
+                UNION ALL
+                SELECT product_id, sub_type_name, current_price, timeframe, 'pct', change_pct
+                FROM variants WHERE change_pct IS NOT NULL
+            ),
+            scoped AS (
+                SELECT product_id, sub_type_name, sub_type_name AS scope, current_price, timeframe, metric, value
+                FROM metrics
+                UNION ALL
+                SELECT product_id, sub_type_name, %(all_sub_types)s, current_price, timeframe, metric, value
+                FROM metrics
+            ),
+            ranked AS (
+                SELECT scoped.*,
+                    ROW_NUMBER() OVER (
+                        PARTITION BY timeframe, metric, scope ORDER BY value DESC, product_id, sub_type_name
+                    ) AS top_rank,
+                    ROW_NUMBER() OVER (
+                        PARTITION BY timeframe, metric, scope ORDER BY value ASC, product_id, sub_type_name
+                    ) AS bottom_rank
+                FROM scoped
+            )
+            INSERT INTO price_change_leaderboard (
+                timeframe, metric, sub_type_name, direction, rank,
+                product_id, variant_sub_type_name, value, current_price
+            )
+            SELECT timeframe, metric, scope, 'top', top_rank, product_id, sub_type_name, value, current_price
+            FROM ranked WHERE top_rank <= %(size)s
+            UNION ALL
+            SELECT timeframe, metric, scope, 'bottom', bottom_rank, product_id, sub_type_name, value, current_price
+            FROM ranked WHERE bottom_rank <= %(size)s
+    """
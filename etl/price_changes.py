@@ -1,13 +1,22 @@
 #!/usr/bin/env python3
 
 import psycopg2
-from psycopg2.extras import execute_batch
+from psycopg2.extras import execute_values
 import logging
 from datetime import datetime, date, timedelta
 import os
 import time
 from dotenv import load_dotenv
 
+from job_lock import run_locked
+from price_change_queries import (
+    TIMEFRAMES, TIMEFRAME_PATTERN, TIMEFRAME_UNIT_DAYS, is_valid_timeframe,
+    LEADERBOARD_SIZE, LEADERBOARD_MIN_PRICE, LEADERBOARD_TIMEFRAMES, LEADERBOARD_ALL_SUB_TYPES,
+    SNAPSHOT_PRICES_QUERY, build_leaderboard_query,
+)
+from price_snapshot import ensure_snapshot_table
+from price_storage import get_prices_as_of
+
 # Load environment variables
 load_dotenv()
 
@@ -30,6 +39,15 @@ DB_PARAMS = {
     "port": os.getenv("DB_PORT", "5432")
 }
 
+for _timeframe in TIMEFRAMES:
+    if not is_valid_timeframe(_timeframe):
+        raise ValueError(f"Unknown timeframe '{_timeframe}' in PRICE_CHANGE_TIMEFRAMES")
+
+# Columns of the price_change compatibility view; the original six always exist
+# so the API keeps working, extra configured timeframes are appended
+LEGACY_TIMEFRAMES = ['7d', '30d', '6m', 'ytd', '1y', 'all']
+VIEW_TIMEFRAMES = LEGACY_TIMEFRAMES + [t for t in TIMEFRAMES if t not in LEGACY_TIMEFRAMES]
+
 def get_db_connection():
     """Establish a connection to the Postgres database with timeout"""
     try:
@@ -86,96 +104,48 @@ def count_products(conn):
     finally:
         cursor.close()
 
+def timeframe_target_date(timeframe, today):
+    """Reference date of a timeframe, or None for 'all' (first recorded price)"""
+    if timeframe == 'all':
+        return None
+    if timeframe == 'ytd':
+        return date(today.year, 1, 1)
+    count, unit = TIMEFRAME_PATTERN.match(timeframe).groups()
+    return today - timedelta(days=int(count) * TIMEFRAME_UNIT_DAYS[unit])
+
 def get_price_data_for_batch(conn, product_ids, today):
-    """Get all required price data for a batch of products in a single query"""
+    """Get all required price data for a batch of products.
+
+    Returns a dict keyed by (product_id, sub_type_name), so every variant of a
+    product (Normal, Holofoil, ...) keeps its own current and reference prices.
+    """
     if not product_ids:
         return {}
-        
-    # Calculate target dates for each timeframe
-    seven_days_ago = today - timedelta(days=7)
-    thirty_days_ago = today - timedelta(days=30)
-    six_months_ago = today - timedelta(days=180)
-    ytd_start = date(today.year, 1, 1)
-    one_year_ago = today - timedelta(days=365)
     
     cursor = conn.cursor()
     price_data = {}
     
     try:
-        # Get current prices
-        placeholders = ','.join(['%s'] * len(product_ids))
-        cursor.execute(f"""
-            WITH latest_prices AS (
-                SELECT DISTINCT ON (product_id, sub_type_name) 
-                    product_id, sub_type_name, market_price, date_point
-                FROM price_history
-                WHERE product_id IN ({placeholders})
-                  AND market_price IS NOT NULL
-                ORDER BY product_id, sub_type_name, date_point DESC
-            )
-            SELECT product_id, sub_type_name, market_price, date_point
-            FROM latest_prices
-        """, product_ids)
+        # Get current and oldest (all-time) prices from the snapshot the ETLs maintain
+        cursor.execute(SNAPSHOT_PRICES_QUERY, (list(product_ids),))
         
         for row in cursor.fetchall():
-            product_id, sub_type, price, price_date = row
-            if product_id not in price_data:
-                price_data[product_id] = {'sub_type_name': sub_type, 'timeframes': {}}
-            price_data[product_id]['current'] = {'price': price, 'date': price_date}
-        
-        # Define timeframes to query
-        timeframes = [
-            ('7d', seven_days_ago),
-            ('30d', thirty_days_ago),
-            ('6m', six_months_ago),
-            ('ytd', ytd_start),
-            ('1y', one_year_ago)
-        ]
+            product_id, sub_type, price, price_date, first_price, first_date = row
+            price_data[(product_id, sub_type)] = {
+                'current': {'price': price, 'date': price_date},
+                'timeframes': {'all': {'price': first_price, 'date': first_date}},
+            }
         
-        # Get historical prices for each timeframe
-        for timeframe_name, target_date in timeframes:
-            cursor.execute(f"""
-                WITH historical_prices AS (
-                    SELECT 
-                        product_id, sub_type_name,
-                        market_price, date_point,
-                        ROW_NUMBER() OVER (
-                            PARTITION BY product_id, sub_type_name 
-                            ORDER BY ABS(date_point - %s)
-                        ) as rn
-                    FROM price_history
-                    WHERE product_id IN ({placeholders})
-                      AND date_point <= %s
-                      AND market_price IS NOT NULL
-                )
-                SELECT product_id, sub_type_name, market_price, date_point
-                FROM historical_prices
-                WHERE rn = 1
-            """, [target_date] + list(product_ids) + [target_date])
-            
-            for row in cursor.fetchall():
-                product_id, sub_type, price, price_date = row
-                if product_id in price_data:
-                    price_data[product_id]['timeframes'][timeframe_name] = {'price': price, 'date': price_date}
-        
-        # Get oldest prices (for all-time comparison)
-        cursor.execute(f"""
-            WITH oldest_prices AS (
-                SELECT DISTINCT ON (product_id, sub_type_name) 
-                    product_id, sub_type_name, market_price, date_point
-                FROM price_history
-                WHERE product_id IN ({placeholders})
-                  AND market_price IS NOT NULL
-                ORDER BY product_id, sub_type_name, date_point ASC
-            )
-            SELECT product_id, sub_type_name, market_price, date_point
-            FROM oldest_prices
-        """, product_ids)
-        
-        for row in cursor.fetchall():
-            product_id, sub_type, price, price_date = row
-            if product_id in price_data:
-                price_data[product_id]['timeframes']['all'] = {'price': price, 'date': price_date}
+        # Get historical prices for each timeframe: the price in effect on the
+        # target date, which also covers change-only histories
+        for timeframe in TIMEFRAMES:
+            target_date = timeframe_target_date(timeframe, today)
+            if target_date is None:
+                continue
+            for product_id, sub_type, price, price_date in get_prices_as_of(cursor, product_ids, target_date):
+                variant = price_data.get((product_id, sub_type))
+                if variant is not None:
+                    variant['timeframes'][timeframe] = {'price': price, 'date': price_date}
                 
         return price_data
     except Exception as e:
@@ -185,177 +155,211 @@ def get_price_data_for_batch(conn, product_ids, today):
         cursor.close()
 
 def update_price_changes_batch(conn, price_data_batch):
-    """Update price changes for a batch of products"""
+    """Upsert one price_change_variant row per variant and timeframe.
+
+    A row is only rewritten when its prices or changes differ from the stored
+    ones, so a flat price costs no write; ref_date is the date of the reference
+    row as of the last change. The current date moves on every load and is
+    kept once per variant in price_snapshot, which the price_change view joins.
+    Returns (rows computed, rows written).
+    """
     if not price_data_batch:
-        return 0
+        return 0, 0
         
     values = []
     
-    for product_id, data in price_data_batch.items():
-        sub_type_name = data.get('sub_type_name', '')
-        current = data.get('current', {'price': None, 'date': None})
-        timeframes = data.get('timeframes', {})
-        
+    for (product_id, sub_type_name), data in price_data_batch.items():
+        current = data['current']
         if current.get('price') is None:
-            continue  # Skip products without current price
-            
-        # Get timeframe data
-        price_7d = timeframes.get('7d', {'price': None, 'date': None})
-        price_30d = timeframes.get('30d', {'price': None, 'date': None})
-        price_6m = timeframes.get('6m', {'price': None, 'date': None})
-        price_ytd = timeframes.get('ytd', {'price': None, 'date': None})
-        price_1y = timeframes.get('1y', {'price': None, 'date': None})
-        price_all = timeframes.get('all', {'price': None, 'date': None})
-        
-        # Calculate changes
-        change_7d_pct = calculate_percent_change(price_7d.get('price'), current.get('price'))
-        change_7d_dollar = calculate_dollar_change(price_7d.get('price'), current.get('price'))
+            continue  # Skip variants without current price
         
-        change_30d_pct = calculate_percent_change(price_30d.get('price'), current.get('price'))
-        change_30d_dollar = calculate_dollar_change(price_30d.get('price'), current.get('price'))
-        
-        change_6m_pct = calculate_percent_change(price_6m.get('price'), current.get('price'))
-        change_6m_dollar = calculate_dollar_change(price_6m.get('price'), current.get('price'))
-        
-        change_ytd_pct = calculate_percent_change(price_ytd.get('price'), current.get('price'))
-        change_ytd_dollar = calculate_dollar_change(price_ytd.get('price'), current.get('price'))
-        
-        change_1y_pct = calculate_percent_change(price_1y.get('price'), current.get('price'))
-        change_1y_dollar = calculate_dollar_change(price_1y.get('price'), current.get('price'))
-        
-        change_all_pct = calculate_percent_change(price_all.get('price'), current.get('price'))
-        change_all_dollar = calculate_dollar_change(price_all.get('price'), current.get('price'))
-        
-        values.append((
-            product_id, sub_type_name,
-            current.get('price'), current.get('date'),
-            
-            price_7d.get('price'), price_7d.get('date'), 
-            change_7d_pct, change_7d_dollar,
-            
-            price_30d.get('price'), price_30d.get('date'),
-            change_30d_pct, change_30d_dollar,
-            
-            price_6m.get('price'), price_6m.get('date'),
-            change_6m_pct, change_6m_dollar,
-            
-            price_ytd.get('price'), price_ytd.get('date'),
-            change_ytd_pct, change_ytd_dollar,
-            
-            price_1y.get('price'), price_1y.get('date'),
-            change_1y_pct, change_1y_dollar,
-            
-            price_all.get('price'), price_all.get('date'),
-            change_all_pct, change_all_dollar,
-            
-            datetime.now()
-        ))
+        for timeframe in TIMEFRAMES:
+            reference = data['timeframes'].get(timeframe, {'price': None, 'date': None})
+            values.append((
+                product_id, sub_type_name, timeframe,
+                reference.get('price'), reference.get('date'), current.get('price'),
+                calculate_percent_change(reference.get('price'), current.get('price')),
+                calculate_dollar_change(reference.get('price'), current.get('price'))
+            ))
     
     if not values:
-        return 0
+        return 0, 0
         
-    # Update the price_change table
     cursor = conn.cursor()
     try:
-        # Ensure the unique constraint exists
-        try:
-            cursor.execute("""
-                SELECT constraint_name
-                FROM information_schema.table_constraints 
-                WHERE table_name = 'price_change' 
-                  AND constraint_type = 'UNIQUE'
-                  AND constraint_name = 'price_change_product_id_key'
-            """)
-            if not cursor.fetchone():
-                cursor.execute("ALTER TABLE price_change ADD CONSTRAINT price_change_product_id_key UNIQUE (product_id)")
-                conn.commit()
-        except Exception as e:
-            conn.rollback()
-            logging.warning(f"Error checking/creating constraint: {e}")
-        
-        # Perform the upsert
         query = """
-            INSERT INTO price_change (
-                product_id, sub_type_name, 
-                current_price, current_price_date,
-                
-                price_7d, price_7d_date, 
-                change_7d_pct, change_7d_dollar,
-                
-                price_30d, price_30d_date,
-                change_30d_pct, change_30d_dollar,
-                
-                price_6m, price_6m_date,
-                change_6m_pct, change_6m_dollar,
-                
-                price_ytd, price_ytd_date,
-                change_ytd_pct, change_ytd_dollar,
-                
-                price_1y, price_1y_date,
-                change_1y_pct, change_1y_dollar,
-                
-                price_all, price_all_date,
-                change_all_pct, change_all_dollar,
-                
-                last_updated
+            INSERT INTO price_change_variant (
+                product_id, sub_type_name, timeframe,
+                ref_price, ref_date, current_price,
+                change_pct, change_dollar, last_updated
             )
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            ON CONFLICT (product_id) DO UPDATE SET
-                sub_type_name = EXCLUDED.sub_type_name,
+            VALUES %s
+            ON CONFLICT (product_id, sub_type_name, timeframe) DO UPDATE SET
+                ref_price = EXCLUDED.ref_price,
+                ref_date = EXCLUDED.ref_date,
                 current_price = EXCLUDED.current_price,
-                current_price_date = EXCLUDED.current_price_date,
-                
-                price_7d = EXCLUDED.price_7d,
-                price_7d_date = EXCLUDED.price_7d_date,
-                change_7d_pct = EXCLUDED.change_7d_pct,
-                change_7d_dollar = EXCLUDED.change_7d_dollar,
-                
-                price_30d = EXCLUDED.price_30d,
-                price_30d_date = EXCLUDED.price_30d_date,
-                change_30d_pct = EXCLUDED.change_30d_pct,
-                change_30d_dollar = EXCLUDED.change_30d_dollar,
-                
-                price_6m = EXCLUDED.price_6m,
-                price_6m_date = EXCLUDED.price_6m_date,
-                change_6m_pct = EXCLUDED.change_6m_pct,
-                change_6m_dollar = EXCLUDED.change_6m_dollar,
-                
-                price_ytd = EXCLUDED.price_ytd,
-                price_ytd_date = EXCLUDED.price_ytd_date,
-                change_ytd_pct = EXCLUDED.change_ytd_pct,
-                change_ytd_dollar = EXCLUDED.change_ytd_dollar,
-                
-                price_1y = EXCLUDED.price_1y,
-                price_1y_date = EXCLUDED.price_1y_date,
-                change_1y_pct = EXCLUDED.change_1y_pct,
-                change_1y_dollar = EXCLUDED.change_1y_dollar,
-                
-                price_all = EXCLUDED.price_all,
-                price_all_date = EXCLUDED.price_all_date,
-                change_all_pct = EXCLUDED.change_all_pct,
-                change_all_dollar = EXCLUDED.change_all_dollar,
-                
+                change_pct = EXCLUDED.change_pct,
+                change_dollar = EXCLUDED.change_dollar,
                 last_updated = EXCLUDED.last_updated
+            WHERE (price_change_variant.ref_price, price_change_variant.current_price,
+                   price_change_variant.change_pct, price_change_variant.change_dollar)
+                  IS DISTINCT FROM
+                  (EXCLUDED.ref_price, EXCLUDED.current_price,
+                   EXCLUDED.change_pct, EXCLUDED.change_dollar)
+            RETURNING 1
         """
-        
-        execute_batch(cursor, query, values, page_size=100)
+        written = execute_values(
+            cursor, query, values,
+            template="(%s, %s, %s, %s, %s, %s, %s, %s, now())",
+            page_size=1000, fetch=True
+        )
         conn.commit()
-        return len(values)
+        return len(values), len(written)
     except Exception as e:
         conn.rollback()
         logging.error(f"Error updating price changes batch: {e}")
+        return 0, 0
+    finally:
+        cursor.close()
+
+def ensure_price_change_tables(conn):
+    """Create price_change_variant and (re)create the price_change compatibility view.
+
+    The original wide price_change table (one row per product_id, so variants
+    overwrote each other) is kept as price_change_legacy the first time. The
+    view pivots the narrow rows back into the old columns, one row per
+    (product_id, sub_type_name), with the current price and date taken from
+    price_snapshot. Rows of timeframes that are no longer configured are
+    removed.
+    """
+    view_columns = []
+    for timeframe in VIEW_TIMEFRAMES:
+        condition = f"FILTER (WHERE timeframe = '{timeframe}')"
+        view_columns.extend([
+            f"MAX(ref_price) {condition} AS price_{timeframe}",
+            f"MAX(ref_date) {condition} AS price_{timeframe}_date",
+            f"MAX(change_pct) {condition} AS change_{timeframe}_pct",
+            f"MAX(change_dollar) {condition} AS change_{timeframe}_dollar",
+        ])
+    view_sql = ",\n                ".join(view_columns)
+
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS price_change_variant (
+                product_id          INTEGER       NOT NULL REFERENCES products (product_id),
+                sub_type_name       VARCHAR(100)  NOT NULL,
+                timeframe           VARCHAR(10)   NOT NULL,
+                ref_price           DECIMAL(10,2),
+                ref_date            DATE,
+                current_price       DECIMAL(10,2) NOT NULL,
+                change_pct          DECIMAL(10,2),
+                change_dollar       DECIMAL(10,2),
+                last_updated        TIMESTAMP(6)  NOT NULL DEFAULT now(),
+                PRIMARY KEY (product_id, sub_type_name, timeframe)
+            )
+        """)
+
+        cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('price_change')")
+        existing = cursor.fetchone()
+        if existing and existing[0] == 'r':
+            cursor.execute("ALTER TABLE price_change RENAME TO price_change_legacy")
+            logging.info("Renamed the wide price_change table to price_change_legacy")
+
+        cursor.execute(
+            "DELETE FROM price_change_variant WHERE timeframe <> ALL(%s)", (TIMEFRAMES,)
+        )
+        if cursor.rowcount:
+            logging.info(f"Removed {cursor.rowcount} rows of timeframes no longer configured")
+
+        cursor.execute("DROP VIEW IF EXISTS price_change")
+        # The current date now lives in price_snapshot only
+        cursor.execute("ALTER TABLE price_change_variant DROP COLUMN IF EXISTS current_price_date")
+        cursor.execute(f"""
+            CREATE VIEW price_change AS
+            SELECT
+                product_id, sub_type_name,
+                s.latest_price AS current_price,
+                s.latest_date AS current_price_date,
+                {view_sql},
+                MAX(v.last_updated) AS last_updated
+            FROM price_change_variant v
+            LEFT JOIN price_snapshot s USING (product_id, sub_type_name)
+            GROUP BY product_id, sub_type_name, s.latest_price, s.latest_date
+        """)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logging.error(f"Error creating price_change tables: {e}")
+        raise
+    finally:
+        cursor.close()
+
+def ensure_leaderboard_table(conn):
+    """Create the price_change_leaderboard table if it does not exist yet"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS price_change_leaderboard (
+                timeframe      VARCHAR(10)   NOT NULL,
+                metric         VARCHAR(10)   NOT NULL,
+                sub_type_name  VARCHAR(100)  NOT NULL,
+                direction      VARCHAR(6)    NOT NULL,
+                rank           SMALLINT      NOT NULL,
+                product_id     INTEGER       NOT NULL,
+                variant_sub_type_name VARCHAR(100) NOT NULL DEFAULT '',
+                value          DECIMAL(10,2) NOT NULL,
+                current_price  DECIMAL(10,2),
+                computed_at    TIMESTAMP(6)  NOT NULL DEFAULT now(),
+                PRIMARY KEY (timeframe, metric, sub_type_name, direction, rank)
+            )
+        """)
+        # Leaderboards built before price_change was per variant lack this column
+        cursor.execute("""
+            ALTER TABLE price_change_leaderboard
+            ADD COLUMN IF NOT EXISTS variant_sub_type_name VARCHAR(100) NOT NULL DEFAULT ''
+        """)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logging.error(f"Error creating price_change_leaderboard table: {e}")
+        raise
+    finally:
+        cursor.close()
+
+def refresh_leaderboards(conn, size=LEADERBOARD_SIZE, min_price=LEADERBOARD_MIN_PRICE):
+    """Rebuild the top-K and bottom-K movers for every timeframe, metric and sub-type.
+
+    Current price is ranked once under the 'current' timeframe; dollar and percent
+    change are ranked for each timeframe. Every list exists per sub-type and across
+    all sub-types ('all'). The whole table is swapped in one transaction, so the API
+    never sees a partial refresh.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute("DELETE FROM price_change_leaderboard")
+        cursor.execute(build_leaderboard_query(LEADERBOARD_TIMEFRAMES), {'min_price': min_price, 'size': size, 'all_sub_types': LEADERBOARD_ALL_SUB_TYPES})
+        inserted = cursor.rowcount
+        conn.commit()
+        return inserted
+    except Exception as e:
+        conn.rollback()
+        logging.error(f"Error refreshing leaderboards: {e}")
         return 0
     finally:
         cursor.close()
 
 def main():
-    """Main function with batching"""
+    """Main function with batching; returns True when the run completed"""
     logging.info("Starting price change calculation with improved batching")
     start_time = datetime.now()
     overall_start = time.time()
     
     try:
         conn = get_db_connection()
+        ensure_snapshot_table(conn)
+        ensure_price_change_tables(conn)
+        logging.info(f"Computing timeframes: {', '.join(TIMEFRAMES)}")
         
         # Get total product count
         total_products = count_products(conn)
@@ -363,6 +367,7 @@ def main():
         
         batch_size = 500  # Process 500 products at a time
         total_processed = 0
+        total_written = 0
         today = date.today()
         
         # Process in batches
@@ -383,16 +388,22 @@ def main():
             price_data = get_price_data_for_batch(conn, product_ids, today)
             
             # Update price changes for this batch
-            updated = update_price_changes_batch(conn, price_data)
-            total_processed += updated
+            computed, written = update_price_changes_batch(conn, price_data)
+            total_processed += computed
+            total_written += written
             
             batch_end = time.time()
             batch_duration = batch_end - batch_start
-            logging.info(f"Batch completed: processed {updated} products in {batch_duration:.2f} seconds")
+            logging.info(f"Batch completed: computed {computed} rows, {written} changed, in {batch_duration:.2f} seconds")
             
             # Optional: add a small delay between batches to reduce database load
             time.sleep(0.5)
         
+        # Precompute the movers lists now that price_change is up to date
+        ensure_leaderboard_table(conn)
+        leaderboard_rows = refresh_leaderboards(conn)
+        logging.info(f"Refreshed leaderboards with {leaderboard_rows} entries (min price ${LEADERBOARD_MIN_PRICE:.2f})")
+        
         conn.close()
         
         overall_end = time.time()
@@ -401,10 +412,12 @@ def main():
         duration_minutes = (end_time - start_time).total_seconds() / 60.0
         
         logging.info(f"Price change calculation completed in {duration_minutes:.2f} minutes")
-        logging.info(f"Total processing time: {overall_duration:.2f} seconds, processed {total_processed} products")
+        logging.info(f"Total processing time: {overall_duration:.2f} seconds, computed {total_processed} rows, wrote {total_written} changed rows")
+        return True
         
     except Exception as e:
         logging.error(f"Price change calculation failed: {e}")
+        return False
         
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    run_locked("price_changes", main)
\ No newline at end of file
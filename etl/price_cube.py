@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""Dense on-disk (day x variant) matrix of daily market prices.
+
+The cube lives in PRICE_CUBE_DIR as three files:
+
+  meta.json          start date, day and variant counts, column capacity and
+                     the name of the data file
+  variants.csv       column -> (product_id, sub_type_name), in column order
+  prices.<gen>.f32   raw float32, day-major, one row of <capacity> columns per
+                     day; NaN where there is no price
+
+Rows are days, so the ETLs append new days in place at the end of the file.
+Columns are reserved ahead of time so new cards usually fit without a rewrite;
+when they do not, a larger data file (the next generation) is written and
+meta.json is switched to it. Days already in the cube are never rewritten in
+place either: reloaded days go into a copy, the next generation, as well. meta.json is always replaced last and atomically,
+so a reader never sees a day or variant count the data file does not cover yet.
+
+Consumers call open_price_cube, which maps the data file read-only with
+numpy.memmap: a card's series is prices[:, column] and a day's cross-section is
+prices[day], both views into the page cache without a Postgres round trip.
+Under PRICE_STORAGE_MODE=changes the gaps between change rows are forward
+filled, so every day holds the price in effect.
+"""
+
+import psycopg2
+import numpy as np
+import pandas as pd
+import argparse
+import json
+import logging
+from datetime import datetime, date, timedelta
+import os
+from dotenv import load_dotenv
+
+from history_frame import KEY_COLUMNS, load_price_history, pivot_daily
+from price_storage import STORAGE_MODE
+from price_validation import ensure_quarantine_table
+
+# Load environment variables
+load_dotenv()
+
+# Database connection parameters
+DB_PARAMS = {
+    "host": os.getenv("DB_HOST", "localhost"),
+    "database": os.getenv("DB_NAME", "pokemon_tcg"),
+    "user": os.getenv("DB_USER", "postgres"),
+    "password": os.getenv("DB_PASSWORD", ""),
+    "port": os.getenv("DB_PORT", "5432")
+}
+
+CUBE_DIR = os.getenv("PRICE_CUBE_DIR", "./price_cube")
+CAPACITY_HEADROOM = 1.25  # Spare columns reserved for new variants
+META_FILE = "meta.json"
+VARIANTS_FILE = "variants.csv"
+
+def _write_atomic(path, write):
+    """Write a file through a temp file and rename it into place"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+def read_meta(path=CUBE_DIR):
+    """The cube's meta.json as a dict, or None when there is no cube yet"""
+    meta_path = os.path.join(path, META_FILE)
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path) as f:
+        return json.load(f)
+
+def write_meta(path, meta):
+    _write_atomic(os.path.join(path, META_FILE), lambda f: json.dump(meta, f, indent=2))
+
+def read_variants(path=CUBE_DIR):
+    """Column order of the cube as a (product_id, sub_type_name) MultiIndex"""
+    variants = pd.read_csv(
+        os.path.join(path, VARIANTS_FILE),
+        dtype={"product_id": np.int32, "sub_type_name": str}, keep_default_na=False
+    )
+    return pd.MultiIndex.from_frame(variants[KEY_COLUMNS])
+
+def write_variants(path, variants):
+    frame = variants.to_frame(index=False)
+    _write_atomic(os.path.join(path, VARIANTS_FILE), lambda f: frame.to_csv(f, index=False))
+
+def data_file_name(generation):
+    return f"prices.{generation}.f32"
+
+def open_price_cube(path=CUBE_DIR):
+    """Map the cube read-only.
+
+    Returns (prices, dates, variants): prices is a (days x variants) float32
+    memmap view, dates a DatetimeIndex of its rows and variants a
+    (product_id, sub_type_name) MultiIndex of its columns, so
+    variants.get_loc((product_id, sub_type_name)) gives a card's column.
+    """
+    meta = read_meta(path)
+    if meta is None:
+        raise FileNotFoundError(f"No price cube in {path}")
+
+    dates = pd.date_range(meta["start_date"], periods=meta["days"], freq="D")
+    variants = read_variants(path)[:meta["variants"]]
+    if meta["days"] == 0:
+        return np.empty((0, meta["variants"]), dtype=np.float32), dates, variants
+
+    prices = np.memmap(
+        os.path.join(path, meta["data_file"]), dtype=np.float32, mode="r",
+        shape=(meta["days"], meta["capacity"])
+    )
+    return prices[:, :meta["variants"]], dates, variants
+
+def fill_mode_limit():
+    """ffill_limit for pivot_daily: change-only histories are valid until the next row"""
+    return None if STORAGE_MODE == "changes" else 0
+
+def build_price_cube(conn, path=CUBE_DIR):
+    """Write the whole cube from price_history, replacing any existing one"""
+    os.makedirs(path, exist_ok=True)
+    old_meta = read_meta(path)
+
+    history = load_price_history(conn, columns=["market_price"])
+    wide = pivot_daily(history, "market_price", ffill_limit=fill_mode_limit())
+    del history
+    if wide.empty:
+        logging.info("price_history is empty, no price cube written")
+        return 0
+
+    # A new generation never overwrites the file current readers have mapped
+    capacity = max(int(wide.shape[1] * CAPACITY_HEADROOM), wide.shape[1] + 1)
+    generation = old_meta["generation"] + 1 if old_meta is not None else 1
+    data_file = data_file_name(generation)
+
+    matrix = np.full((wide.shape[0], capacity), np.nan, dtype=np.float32)
+    matrix[:, :wide.shape[1]] = wide.values
+    matrix.tofile(os.path.join(path, data_file))
+
+    write_variants(path, wide.columns)
+    write_meta(path, {
+        "start_date": wide.index[0].date().isoformat(),
+        "days": wide.shape[0],
+        "variants": wide.shape[1],
+        "capacity": capacity,
+        "generation": generation,
+        "data_file": data_file,
+        "dtype": "float32",
+    })
+    if old_meta is not None:
+        os.remove(os.path.join(path, old_meta["data_file"]))
+
+    logging.info(f"Built price cube of {wide.shape[0]} days x {wide.shape[1]} variants in {path}")
+    return wide.shape[0]
+
+def grow_capacity(path, meta, needed):
+    """Copy the cube into a data file with room for at least needed variants"""
+    capacity = max(int(needed * CAPACITY_HEADROOM), needed + 1)
+    logging.info(f"Growing price cube capacity from {meta['capacity']} to {capacity} variants")
+    return copy_generation(path, meta, capacity)
+
+def copy_generation(path, meta, capacity):
+    """Copy the cube into the next generation's data file, with capacity columns.
+
+    Returns the meta of the copy and the old data file, which the caller
+    removes once meta.json points at the copy.
+    """
+    old_file = os.path.join(path, meta["data_file"])
+    generation = meta["generation"] + 1
+    new_name = data_file_name(generation)
+
+    old = np.memmap(old_file, dtype=np.float32, mode="r", shape=(meta["days"], meta["capacity"]))
+    new = np.memmap(os.path.join(path, new_name), dtype=np.float32, mode="w+", shape=(meta["days"], capacity))
+    new[:, :meta["capacity"]] = old
+    new[:, meta["capacity"]:] = np.nan
+    new.flush()
+    del old, new
+
+    return dict(meta, capacity=capacity, generation=generation, data_file=new_name), old_file
+
+def update_price_cube(conn, path=CUBE_DIR, since=None):
+    """Append the days loaded since the last update to the cube.
+
+    Reads price_history from the day after the cube's last day (or from since,
+    to rewrite recent days that were reloaded) and appends those rows in
+    place, adding columns for new variants. When since reaches back into days
+    the cube already has, they are written into a copy (the next generation)
+    instead, so readers that mapped the current file never see it change.
+    Builds the cube when none exists. Returns the number of days written.
+    """
+    meta = read_meta(path)
+    if meta is None or meta["days"] == 0:
+        return build_price_cube(conn, path)
+
+    start = date.fromisoformat(meta["start_date"])
+    last_day = start + timedelta(days=meta["days"] - 1)
+    from_date = last_day + timedelta(days=1)
+    if since is not None:
+        from_date = max(start, min(from_date, since))
+
+    history = load_price_history(conn, columns=["market_price"], start_date=from_date)
+    if history.empty:
+        logging.info(f"Price cube is up to date through {last_day}")
+        return 0
+    wide = pivot_daily(history, "market_price", start_date=from_date, ffill_limit=0)
+    del history
+
+    # Columns for variants the cube has not seen yet
+    variants = read_variants(path)[:meta["variants"]]
+    new_variants = wide.columns.difference(variants)
+    old_file = None
+    if len(new_variants):
+        variants = variants.append(new_variants)
+        if len(variants) > meta["capacity"]:
+            meta, old_file = grow_capacity(path, meta, len(variants))
+        write_variants(path, variants)
+    columns = variants.get_indexer(wide.columns)
+
+    first_row = (from_date - start).days
+    if first_row < meta["days"] and old_file is None:
+        meta, old_file = copy_generation(path, meta, meta["capacity"])
+
+    # Extend the data file with NaN rows for the new days
+    days = max(meta["days"], first_row + wide.shape[0])
+    data_path = os.path.join(path, meta["data_file"])
+    if days > meta["days"]:
+        with open(data_path, "ab") as f:
+            np.full((days - meta["days"], meta["capacity"]), np.nan, dtype=np.float32).tofile(f)
+
+    cube = np.memmap(data_path, dtype=np.float32, mode="r+", shape=(days, meta["capacity"]))
+    block = np.full((wide.shape[0], meta["capacity"]), np.nan, dtype=np.float32)
+    block[:, columns] = wide.values
+    if fill_mode_limit() is None:
+        # Seed the fill with the day before the block so unchanged variants
+        # carry their price forward into the new days
+        seed = cube[first_row - 1] if first_row > 0 else np.full(meta["capacity"], np.nan, dtype=np.float32)
+        block = pd.DataFrame(np.vstack([seed, block])).ffill().values[1:].astype(np.float32)
+    cube[first_row:first_row + wide.shape[0]] = block
+    cube.flush()
+    del cube
+
+    write_meta(path, dict(meta, days=days, variants=len(variants)))
+    if old_file is not None:
+        os.remove(old_file)
+
+    logging.info(f"Wrote {wide.shape[0]} days from {from_date} to the price cube ({len(new_variants)} new variants)")
+    return wide.shape[0]
+
+def main():
+    """Bring the price cube up to date, or rebuild it from scratch"""
+    parser = argparse.ArgumentParser(description="Maintain the memory-mapped daily price cube")
+    parser.add_argument("--rebuild", action="store_true", help="rewrite the whole cube from price_history")
+    parser.add_argument("--since", type=date.fromisoformat, help="rewrite days from this date on")
+    parser.add_argument("--path", default=CUBE_DIR, help=f"cube directory (default: {CUBE_DIR})")
+    args = parser.parse_args()
+
+    logging.info("Starting price cube update")
+    start_time = datetime.now()
+
+    try:
+        conn = psycopg2.connect(**DB_PARAMS)
+        ensure_quarantine_table(conn)  # load_price_history skips held rows
+        if args.rebuild:
+            build_price_cube(conn, args.path)
+        else:
+            update_price_cube(conn, args.path, since=args.since)
+        conn.close()
+
+        duration = (datetime.now() - start_time).total_seconds()
+        logging.info(f"Price cube update completed in {duration:.2f} seconds")
+
+    except Exception as e:
+        logging.error(f"Price cube update failed: {e}")
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] %(message)s",
+        handlers=[
+            logging.FileHandler("price_cube.log"),
+            logging.StreamHandler()
+        ]
+    )
+    main()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""Per-(product, sub_type) snapshot of the first and latest observed market price.
+
+The ETLs call update_price_snapshot with the rows their price_history insert
+actually wrote (INSERT ... RETURNING), so the snapshot stays current without
+rescanning price_history. Running this file rebuilds it from scratch.
+"""
+
+import psycopg2
+from psycopg2.extras import execute_values
+import logging
+from datetime import datetime
+import os
+from dotenv import load_dotenv
+
+from price_storage import NOT_QUARANTINED_SQL
+from price_validation import ensure_quarantine_table
+
+# Load environment variables
+load_dotenv()
+
+# Database connection parameters
+DB_PARAMS = {
+    "host": os.getenv("DB_HOST", "localhost"),
+    "database": os.getenv("DB_NAME", "pokemon_tcg"),
+    "user": os.getenv("DB_USER", "postgres"),
+    "password": os.getenv("DB_PASSWORD", ""),
+    "port": os.getenv("DB_PORT", "5432")
+}
+
+def ensure_snapshot_table(conn):
+    """Create price_snapshot if needed, filling it from price_history the first time.
+
+    Returns True when the table was created (and therefore just rebuilt).
+    Also creates price_quarantine, which the snapshot and the loaders read.
+    """
+    ensure_quarantine_table(conn)
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT to_regclass('price_snapshot')")
+        if cursor.fetchone()[0] is not None:
+            return False
+
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS price_snapshot (
+                product_id     INTEGER       NOT NULL,
+                sub_type_name  VARCHAR(100)  NOT NULL,
+                first_price    DECIMAL(10,2) NOT NULL,
+                first_date     DATE          NOT NULL,
+                latest_price   DECIMAL(10,2) NOT NULL,
+                latest_date    DATE          NOT NULL,
+                updated_at     TIMESTAMP(6)  NOT NULL DEFAULT now(),
+                PRIMARY KEY (product_id, sub_type_name)
+            )
+        """)
+        conn.commit()
+        logging.info("Created price_snapshot table")
+    except Exception as e:
+        conn.rollback()
+        logging.error(f"Error creating price_snapshot table: {e}")
+        raise
+    finally:
+        cursor.close()
+
+    rebuild_price_snapshot(conn)
+    return True
+
+def update_price_snapshot(cursor, inserted_rows):
+    """Fold newly inserted price_history rows into the snapshot.
+
+    inserted_rows are (product_id, sub_type_name, date_point, market_price)
+    tuples from price_storage.rows_in_effect (the INSERT ... RETURNING rows,
+    plus unchanged records in changes mode), minus the quarantined ones. Runs on the caller's cursor so it commits or rolls back
+    together with the insert.
+    """
+    bounds = {}
+    for product_id, sub_type_name, date_point, market_price in inserted_rows:
+        if market_price is None:
+            continue
+        key = (product_id, sub_type_name)
+        current = bounds.get(key)
+        if current is None:
+            bounds[key] = [date_point, market_price, date_point, market_price]
+            continue
+        if date_point < current[0]:
+            current[0], current[1] = date_point, market_price
+        if date_point > current[2]:
+            current[2], current[3] = date_point, market_price
+
+    if not bounds:
+        return 0
+
+    values = [(key[0], key[1], *b) for key, b in bounds.items()]
+    execute_values(cursor, """
+        INSERT INTO price_snapshot (
+            product_id, sub_type_name, first_date, first_price, latest_date, latest_price
+        )
+        VALUES %s
+        ON CONFLICT (product_id, sub_type_name) DO UPDATE SET
+            first_price = CASE WHEN EXCLUDED.first_date < price_snapshot.first_date
+                               THEN EXCLUDED.first_price ELSE price_snapshot.first_price END,
+            first_date = LEAST(price_snapshot.first_date, EXCLUDED.first_date),
+            latest_price = CASE WHEN EXCLUDED.latest_date >= price_snapshot.latest_date
+                                THEN EXCLUDED.latest_price ELSE price_snapshot.latest_price END,
+            latest_date = GREATEST(price_snapshot.latest_date, EXCLUDED.latest_date),
+            updated_at = now()
+    """, values, page_size=1000)
+    return len(values)
+
+def rebuild_price_snapshot(conn):
+    """Recompute the whole snapshot from the non-quarantined price_history rows in one statement.
+
+    On a compacted or change-only history the last row is the last change, so
+    latest_date is the date of that change until the next load moves it on.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute("DELETE FROM price_snapshot")
+        cursor.execute(f"""
+            INSERT INTO price_snapshot (
+                product_id, sub_type_name, first_date, first_price, latest_date, latest_price
+            )
+            SELECT f.product_id, f.sub_type_name, f.date_point, f.market_price, l.date_point, l.market_price
+            FROM (
+                SELECT DISTINCT ON (product_id, sub_type_name)
+                    product_id, sub_type_name, date_point, market_price
+                FROM price_history ph
+                WHERE market_price IS NOT NULL
+                  AND {NOT_QUARANTINED_SQL.format(alias="ph")}
+                ORDER BY product_id, sub_type_name, date_point ASC
+            ) f
+            JOIN (
+                SELECT DISTINCT ON (product_id, sub_type_name)
+                    product_id, sub_type_name, date_point, market_price
+                FROM price_history ph
+                WHERE market_price IS NOT NULL
+                  AND {NOT_QUARANTINED_SQL.format(alias="ph")}
+                ORDER BY product_id, sub_type_name, date_point DESC
+            ) l USING (product_id, sub_type_name)
+        """)
+        rebuilt = cursor.rowcount
+        conn.commit()
+        logging.info(f"Rebuilt price_snapshot with {rebuilt} variants")
+        return rebuilt
+    except Exception as e:
+        conn.rollback()
+        logging.error(f"Error rebuilding price_snapshot: {e}")
+        raise
+    finally:
+        cursor.close()
+
+def main():
+    """Rebuild the price snapshot from the full price history"""
+    logging.info("Starting price snapshot rebuild")
+    start_time = datetime.now()
+
+    try:
+        conn = psycopg2.connect(**DB_PARAMS)
+        if not ensure_snapshot_table(conn):
+            rebuild_price_snapshot(conn)
+        conn.close()
+
+        duration = (datetime.now() - start_time).total_seconds()
+        logging.info(f"Price snapshot rebuild completed in {duration:.2f} seconds")
+
+    except Exception as e:
+        logging.error(f"Price snapshot rebuild failed: {e}")
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] %(message)s",
+        handlers=[
+            logging.FileHandler("price_snapshot.log"),
+            logging.StreamHandler()
+        ]
+    )
+    main()
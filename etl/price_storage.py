@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""Writing and reading price_history under the configured storage mode.
+
+PRICE_STORAGE_MODE=full     one row per variant per day (the original layout)
+PRICE_STORAGE_MODE=changes  a row is only written when any price field differs
+                            from the variant's previous row
+
+compact_price_history.py turns a full history into the change-only layout by
+deleting the rows that repeat the previous one, so after compaction (and in
+changes mode) there is no longer a row for every day. Every reader therefore
+uses the same semantics, whatever the layout:
+
+  - a row is in effect from its date_point until the variant's next row;
+    quarantined (held) rows are skipped as if they did not exist
+  - get_prices_as_of returns the price in effect on the requested date, the
+    same for a dense daily history, a compacted one and a change-only one,
+    with the date of the row it comes from; that date is when the price was
+    last seen (dense) or first recorded (change-only), so an old one still
+    tells the API the price may be stale
+  - price_snapshot.first_date is the date of the first row, which compaction
+    never removes; latest_price is the price in effect on the last load and
+    latest_date that load's date, because in changes mode the loaders fold
+    unchanged records into the snapshot too (see rows_in_effect). Only a
+    rebuild from change-only rows falls back to the date of the last change,
+    until the next load moves it forward again
+  - the batch stages pivot through history_frame.pivot_daily, which forward
+    fills without limit for change-only histories
+"""
+
+import os
+from psycopg2.extras import execute_values
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+STORAGE_MODE = os.getenv("PRICE_STORAGE_MODE", "full")
+STORAGE_MODES = ("full", "changes")
+
+if STORAGE_MODE not in STORAGE_MODES:
+    raise ValueError(f"Unknown PRICE_STORAGE_MODE '{STORAGE_MODE}', expected one of {', '.join(STORAGE_MODES)}")
+
+INSERT_COLUMNS = """
+    product_id, group_id, sub_type_name, date_point, period_type, end_date,
+    open_price, close_price, low_price, high_price, mid_price,
+    market_price, direct_low_price, volume
+"""
+
+# Rows price_validation.py holds in quarantine (spikes, inversions) are
+# skipped, so the price in effect is the last trustworthy one
+NOT_QUARANTINED_SQL = (
+    "NOT EXISTS (SELECT 1 FROM price_quarantine q"
+    " WHERE q.product_id = {alias}.product_id AND q.sub_type_name = {alias}.sub_type_name"
+    " AND q.date_point = {alias}.date_point AND q.held)"
+)
+
+# Price in effect on a date for each variant of a set of products
+AS_OF_PRICES_QUERY = f"""
+    SELECT DISTINCT ON (product_id, sub_type_name)
+        product_id, sub_type_name, market_price, date_point
+    FROM price_history ph
+    WHERE product_id = ANY(%s)
+      AND date_point <= %s
+      AND market_price IS NOT NULL
+      AND {NOT_QUARANTINED_SQL.format(alias="ph")}
+    ORDER BY product_id, sub_type_name, date_point DESC
+"""
+
+def insert_prices(cursor, group_id, date_val, prices, mode=None):
+    """Insert one group's prices for one date and return the rows actually written.
+
+    prices are (product_id, sub_type_name, low, high, mid, market, direct_low)
+    tuples. group_id, the date and the always-NULL columns are bound once for
+    the whole statement. Returns (product_id, sub_type_name, date_point,
+    market_price) for every inserted row, ready for update_price_snapshot.
+    Does not commit.
+    """
+    if not prices:
+        return []
+
+    mode = mode or STORAGE_MODE
+    group_sql = cursor.mogrify("%s", (group_id,)).decode()
+    date_sql = cursor.mogrify("%s", (date_val,)).decode()
+
+    if mode == "full":
+        template = (
+            f"(%s, {group_sql}, %s, {date_sql}, 'daily', NULL, NULL, NULL, %s, %s, %s, %s, %s, NULL)"
+        )
+        query = f"""
+            INSERT INTO price_history ({INSERT_COLUMNS})
+            VALUES %s
+            ON CONFLICT (product_id, sub_type_name, date_point, period_type) DO NOTHING
+            RETURNING product_id, sub_type_name, date_point, market_price
+        """
+        return execute_values(cursor, query, prices, template=template, page_size=1000, fetch=True)
+
+    # Change-only: compare every incoming row with the variant's previous row
+    # (one index probe on the natural key) and only keep the ones that differ.
+    # Quarantined rows are not a valid previous price, so a price that repeats
+    # a quarantined one is still written rather than hidden behind it.
+    # Values are cast to the column type first so 1.234 and 1.23 compare equal.
+    template = "(%s::integer, %s::varchar, %s::decimal(10,2), %s::decimal(10,2), %s::decimal(10,2), %s::decimal(10,2), %s::decimal(10,2))"
+    query = f"""
+        INSERT INTO price_history ({INSERT_COLUMNS})
+        SELECT v.product_id, {group_sql}, v.sub_type_name, {date_sql}, 'daily', NULL, NULL, NULL,
+               v.low_price, v.high_price, v.mid_price, v.market_price, v.direct_low_price, NULL
+        FROM (VALUES %s) AS v(product_id, sub_type_name, low_price, high_price, mid_price,
+                              market_price, direct_low_price)
+        LEFT JOIN LATERAL (
+            SELECT ph.date_point, ph.low_price, ph.high_price, ph.mid_price,
+                   ph.market_price, ph.direct_low_price
+            FROM price_history ph
+            WHERE ph.product_id = v.product_id
+              AND ph.sub_type_name = v.sub_type_name
+              AND ph.period_type = 'daily'
+              AND ph.date_point < {date_sql}
+              AND {NOT_QUARANTINED_SQL.format(alias="ph")}
+            ORDER BY ph.date_point DESC
+            LIMIT 1
+        ) prev ON TRUE
+        WHERE prev.date_point IS NULL
+           OR (v.low_price, v.high_price, v.mid_price, v.market_price, v.direct_low_price)
+              IS DISTINCT FROM
+              (prev.low_price, prev.high_price, prev.mid_price, prev.market_price, prev.direct_low_price)
+        ON CONFLICT (product_id, sub_type_name, date_point, period_type) DO NOTHING
+        RETURNING product_id, sub_type_name, date_point, market_price
+    """
+    return execute_values(cursor, query, prices, template=template, page_size=1000, fetch=True)
+
+def rows_in_effect(prices, inserted, date_val, mode=None):
+    """Rows showing each variant's price in effect on date_val, for update_price_snapshot.
+
+    In full mode these are the inserted rows. In changes mode an unchanged
+    record is not inserted but still confirms its price on date_val, so every
+    record with a market price counts; that keeps the snapshot's latest_date
+    at the last load date, as in full mode.
+    """
+    mode = mode or STORAGE_MODE
+    if mode == "full":
+        return inserted
+    return [(record[0], record[1], date_val, record[5]) for record in prices if record[5] is not None]
+
+def get_prices_as_of(cursor, product_ids, as_of_date):
+    """Market price of each variant of product_ids as of a date.
+
+    Returns (product_id, sub_type_name, market_price, date_point) rows from the
+    most recent non-quarantined row on or before as_of_date, i.e. the row in
+    effect on that date.
+    """
+    if not product_ids:
+        return []
+
+    cursor.execute(AS_OF_PRICES_QUERY, (list(product_ids), as_of_date))
+    return cursor.fetchall()
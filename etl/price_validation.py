@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""Screening of incoming daily prices before they reach price_history.
+
+Both ETLs pass each group's price records through screen_prices right before
+insert_prices. Every check runs on the whole batch at once with numpy:
+
+  invalid   a price that is not a finite number in [MIN_VALID_PRICE,
+            MAX_VALID_PRICE]; that field is stored as NULL, and a record
+            with no valid field left is rejected and never inserted
+  inverted  low_price above high_price
+  spike     market_price far from the variant's recent median, measured in
+            MADs (median absolute deviations) of the prices in effect on
+            each of its last SPIKE_WINDOW days
+
+Inverted and spiking records are still inserted, so the raw history is kept,
+but they are recorded in price_quarantine as held. Held rows are kept out of
+price_snapshot and skipped by every reader: get_prices_as_of (price_changes.py)
+and load_price_history (indicators, charts, cube, indexes, snapshots).
+Quarantined rows stay in the baseline of later days, so a price that really
+moved to a new level stops being flagged once it has held for about half the
+window.
+"""
+
+import logging
+import numpy as np
+from psycopg2.extras import execute_values
+import os
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+MIN_VALID_PRICE = 0.01
+MAX_VALID_PRICE = 1_000_000.0  # Above any sale on record; also keeps DECIMAL(10,2) from overflowing
+SPIKE_WINDOW = int(os.getenv("PRICE_SPIKE_WINDOW", "14"))  # Most recent days per variant in the baseline
+SPIKE_MIN_HISTORY = 5  # Fewer baseline days with a price than this and no spike check is made
+SPIKE_MAD_THRESHOLD = float(os.getenv("PRICE_SPIKE_MAD_THRESHOLD", "6"))
+SPIKE_MIN_RATIO = float(os.getenv("PRICE_SPIKE_MIN_RATIO", "2.0"))  # And at least doubled or halved...
+SPIKE_MIN_DOLLARS = 0.50  # ...and by at least this much, so penny cards do not trip it
+SPIKE_MIN_SPREAD = 0.05  # Floor of the MAD as a fraction of the median, for flat histories
+BASELINE_MAX_DAYS = 180  # Rows older than this never count towards the baseline
+
+# Order of the price fields in the records the loaders build
+PRICE_FIELDS = ["low_price", "high_price", "mid_price", "market_price", "direct_low_price"]
+
+# Market price rows of each incoming variant in the SPIKE_WINDOW days before
+# the date, plus the last one before those days, which is still in effect at
+# their start; index range scans per variant on the natural key (as in the
+# change-only insert). ord is the variant's 1-based position in the batch and
+# age the row's age in days, 1 = the day before.
+BASELINE_QUERY = """
+    SELECT v.ord, %(date)s::date - h.date_point AS age, h.market_price::float8
+    FROM unnest(%(product_ids)s::integer[], %(sub_types)s::varchar[]) WITH ORDINALITY AS v(product_id, sub_type_name, ord)
+    CROSS JOIN LATERAL (
+        (SELECT ph.date_point, ph.market_price
+         FROM price_history ph
+         WHERE ph.product_id = v.product_id
+           AND ph.sub_type_name = v.sub_type_name
+           AND ph.period_type = 'daily'
+           AND ph.date_point < %(date)s
+           AND ph.date_point >= %(date)s::date - %(window)s
+           AND ph.market_price IS NOT NULL)
+        UNION ALL
+        (SELECT ph.date_point, ph.market_price
+         FROM price_history ph
+         WHERE ph.product_id = v.product_id
+           AND ph.sub_type_name = v.sub_type_name
+           AND ph.period_type = 'daily'
+           AND ph.date_point < %(date)s::date - %(window)s
+           AND ph.date_point >= %(date)s::date - %(max_days)s
+           AND ph.market_price IS NOT NULL
+         ORDER BY ph.date_point DESC
+         LIMIT 1)
+    ) h
+"""
+
+def ensure_quarantine_table(conn):
+    """Create the price_quarantine table if it does not exist yet"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS price_quarantine (
+                product_id        INTEGER          NOT NULL,
+                sub_type_name     VARCHAR(100)     NOT NULL,
+                date_point        DATE             NOT NULL,
+                group_id          INTEGER          NOT NULL,
+                reasons           VARCHAR(50)      NOT NULL,
+                rejected          BOOLEAN          NOT NULL,
+                held              BOOLEAN          NOT NULL,
+                low_price         DOUBLE PRECISION,
+                high_price        DOUBLE PRECISION,
+                mid_price         DOUBLE PRECISION,
+                market_price      DOUBLE PRECISION,
+                direct_low_price  DOUBLE PRECISION,
+                baseline_price    REAL,
+                flagged_at        TIMESTAMP(6)     NOT NULL DEFAULT now(),
+                PRIMARY KEY (product_id, sub_type_name, date_point)
+            )
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_price_quarantine_date
+            ON price_quarantine (date_point)
+        """)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logging.error(f"Error creating price_quarantine table: {e}")
+        raise
+    finally:
+        cursor.close()
+
+def to_price_matrix(prices):
+    """(records x PRICE_FIELDS) float matrix of the records plus a mask of present values.
+
+    Values that are present but not numbers become NaN, so they fail the
+    finiteness check instead of passing as missing.
+    """
+    raw = [record[2:] for record in prices]
+    present = ~np.equal(np.array(raw, dtype=object), None)
+    try:
+        values = np.array(raw, dtype=np.float64)
+    except (TypeError, ValueError):
+        values = np.array([[_to_float(value) for value in row] for row in raw], dtype=np.float64)
+    return values, present
+
+def _to_float(value):
+    try:
+        return float(value) if value is not None else np.nan
+    except (TypeError, ValueError):
+        return np.nan
+
+def load_baseline(cursor, prices, date_val, window=SPIKE_WINDOW):
+    """(records x window) matrix of each record's market price in effect per day, newest first.
+
+    Column k is the price in effect k + 1 days before date_val, NaN before the
+    variant's first price. Each row is carried forward to the day before the
+    next one, so a stable card counts every day whether its history has a row
+    per day or only its changes (PRICE_STORAGE_MODE=changes, or compacted).
+    """
+    # One extra column, oldest, for the row in effect when the window opens
+    baseline = np.full((len(prices), window + 1), np.nan)
+    cursor.execute(BASELINE_QUERY, {
+        "product_ids": [record[0] for record in prices], "sub_types": [record[1] for record in prices],
+        "date": date_val, "window": window, "max_days": BASELINE_MAX_DAYS,
+    })
+    rows = cursor.fetchall()
+    if rows:
+        rows = np.array(rows, dtype=np.float64)
+        ages = np.minimum(rows[:, 1].astype(np.int64), window + 1)
+        baseline[rows[:, 0].astype(np.int64) - 1, ages - 1] = rows[:, 2]
+
+    # Forward fill in time, i.e. from the oldest column towards the newest
+    oldest_first = baseline[:, ::-1]
+    positions = np.where(~np.isnan(oldest_first), np.arange(window + 1), 0)
+    np.maximum.accumulate(positions, axis=1, out=positions)
+    filled = np.take_along_axis(oldest_first, positions, axis=1)
+    return filled[:, ::-1][:, :window]
+
+def row_median(values, counts):
+    """Median of the non-NaN values of every row, given each row's count of them.
+
+    np.sort puts NaN last, so each row's middle element(s) sit at fixed
+    positions; much faster than np.nanmedian on many short rows.
+    """
+    ordered = np.sort(values, axis=1)
+    lower = np.take_along_axis(ordered, ((counts - 1) // 2)[:, None], axis=1)[:, 0]
+    upper = np.take_along_axis(ordered, (counts // 2)[:, None], axis=1)[:, 0]
+    return (lower + upper) / 2
+
+def find_spikes(market, baseline):
+    """Mask of market prices that sit far outside their baseline, and the baseline medians"""
+    spikes = np.zeros(len(market), dtype=bool)
+    medians = np.full(len(market), np.nan)
+    counts = np.count_nonzero(~np.isnan(baseline), axis=1)
+    checked = (counts >= SPIKE_MIN_HISTORY) & ~np.isnan(market)
+    if not checked.any():
+        return spikes, medians
+
+    history, counts = baseline[checked], counts[checked]
+    median = row_median(history, counts)
+    mad = row_median(np.abs(history - median[:, None]), counts)
+    # 1.4826 scales the MAD to a standard deviation for normally distributed noise
+    scale = np.maximum(1.4826 * mad, SPIKE_MIN_SPREAD * median)
+    price = market[checked]
+    deviation = np.abs(price - median)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = price / median
+        spikes[checked] = (
+            (deviation > SPIKE_MAD_THRESHOLD * scale)
+            & (deviation >= SPIKE_MIN_DOLLARS)
+            & ((ratio >= SPIKE_MIN_RATIO) | (ratio <= 1 / SPIKE_MIN_RATIO))
+        )
+    medians[checked] = median
+    return spikes, medians
+
+def quarantine_prices(cursor, group_id, date_val, rows):
+    """Upsert price_quarantine rows without committing"""
+    execute_values(cursor, f"""
+        INSERT INTO price_quarantine (
+            product_id, sub_type_name, date_point, group_id, reasons, rejected, held,
+            {", ".join(PRICE_FIELDS)}, baseline_price
+        )
+        VALUES %s
+        ON CONFLICT (product_id, sub_type_name, date_point) DO UPDATE SET
+            group_id = EXCLUDED.group_id, reasons = EXCLUDED.reasons,
+            rejected = EXCLUDED.rejected, held = EXCLUDED.held,
+            low_price = EXCLUDED.low_price, high_price = EXCLUDED.high_price,
+            mid_price = EXCLUDED.mid_price, market_price = EXCLUDED.market_price,
+            direct_low_price = EXCLUDED.direct_low_price, baseline_price = EXCLUDED.baseline_price,
+            flagged_at = now()
+    """, [(row[0], row[1], date_val, group_id, *row[2:]) for row in rows], page_size=1000)
+
+def screen_prices(cursor, group_id, date_val, prices):
+    """Validate one group's price records for one date before they are inserted.
+
+    prices are the (product_id, sub_type_name, low, high, mid, market,
+    direct_low) records insert_prices takes. Invalid fields are set to NULL
+    and the rest of the record is kept; only a record with no valid field left
+    is rejected. Flagged records are written to price_quarantine, with their
+    original values, on the caller's cursor, so they commit or roll back with
+    the insert. Returns (records to insert, keys of the inserted records that
+    are held and must not reach the snapshot).
+    """
+    if not prices:
+        return prices, set()
+
+    values, present = to_price_matrix(prices)
+    with np.errstate(invalid="ignore"):
+        bad_fields = present & ~((values >= MIN_VALID_PRICE) & (values <= MAX_VALID_PRICE))
+    valid = present & ~bad_fields
+    invalid = bad_fields.any(axis=1)
+    rejected = invalid & ~valid.any(axis=1)
+
+    clean = np.where(valid, values, np.nan)
+    inverted = clean[:, 0] > clean[:, 1]
+    spikes, medians = find_spikes(clean[:, 3], load_baseline(cursor, prices, date_val))
+    held_mask = (inverted | spikes) & ~rejected
+
+    flagged = np.flatnonzero(invalid | inverted | spikes)
+    if len(flagged) == 0:
+        return prices, set()
+
+    rows = []
+    for i in flagged:
+        reasons = [name for name, mask in (("invalid", invalid), ("inverted", inverted), ("spike", spikes)) if mask[i]]
+        prices_row = [float(v) if p else None for v, p in zip(values[i], present[i])]
+        baseline = float(medians[i]) if not np.isnan(medians[i]) else None
+        rows.append((prices[i][0], prices[i][1], ",".join(reasons), bool(rejected[i]), bool(held_mask[i]),
+                     *prices_row, baseline))
+    quarantine_prices(cursor, group_id, date_val, rows)
+
+    cleaned = int((invalid & ~rejected).sum())
+    if rejected.any():
+        logging.warning(f"Rejected {int(rejected.sum())} price records with no valid price for group {group_id} on {date_val}")
+    if cleaned:
+        logging.warning(f"Dropped invalid fields of {cleaned} price records for group {group_id} on {date_val}")
+    if held_mask.any():
+        logging.info(f"Quarantined {int(held_mask.sum())} suspicious price records for group {group_id} on {date_val}")
+
+    accepted = []
+    for i, record in enumerate(prices):
+        if rejected[i]:
+            continue
+        if invalid[i]:
+            record = (*record[:2], *(value if ok else None for value, ok in zip(record[2:], valid[i])))
+        accepted.append(record)
+    held = {(record[0], record[1]) for record, bad in zip(prices, held_mask) if bad}
+    return accepted, held
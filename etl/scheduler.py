@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""Long-running scheduler that runs the ETL chain only when tcgcsv has new data.
+
+Every SCHEDULER_POLL_SECONDS it fetches the small last-updated.txt marker.
+Each job in JOB_CHAIN records in etl_job_state the marker it last completed.
+A job runs when that marker is behind the upstream one and the job before it
+in the chain has already completed the current marker, so an interrupted
+chain resumes where it stopped. Every job runs under its advisory lock
+(job_lock), which also keeps cron-launched runs of the same script out. The
+job modules are imported once, so pandas, psycopg2 and the HTTP session stay
+warm between runs.
+"""
+
+import psycopg2
+import argparse
+import logging
+import signal
+import threading
+from datetime import datetime, timedelta
+import os
+from dotenv import load_dotenv
+
+from job_lock import run_locked
+
+# Load environment variables
+load_dotenv()
+
+# Configure logging before the job modules are imported, so their output
+# goes to the scheduler's log as well
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+    handlers=[
+        logging.FileHandler("scheduler.log"),
+        logging.StreamHandler()
+    ]
+)
+
+import etl_script
+import investment_scores
+import price_changes
+
+# Database connection parameters
+DB_PARAMS = {
+    "host": os.getenv("DB_HOST", "localhost"),
+    "database": os.getenv("DB_NAME", "pokemon_tcg"),
+    "user": os.getenv("DB_USER", "postgres"),
+    "password": os.getenv("DB_PASSWORD", ""),
+    "port": os.getenv("DB_PORT", "5432")
+}
+
+POLL_SECONDS = int(os.getenv("SCHEDULER_POLL_SECONDS", "300"))
+RETRY_SECONDS = int(os.getenv("SCHEDULER_RETRY_SECONDS", "1800"))  # Wait before rerunning a failed job
+MARKER_URL = "https://tcgcsv.com/last-updated.txt"
+
+# Jobs in dependency order: (job name / lock name, entry point returning True on success)
+JOB_CHAIN = [
+    ("daily_etl", etl_script.main),
+    ("price_changes", price_changes.main),
+    ("investment_scores", investment_scores.main),
+]
+
+def ensure_state_table(conn):
+    """Create the etl_job_state table if it does not exist yet"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS etl_job_state (
+                job_name          VARCHAR(50)  PRIMARY KEY,
+                last_marker       VARCHAR(50),
+                last_started_at   TIMESTAMP(6),
+                last_finished_at  TIMESTAMP(6),
+                last_status       VARCHAR(10)
+            )
+        """)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logging.error(f"Error creating etl_job_state table: {e}")
+        raise
+    finally:
+        cursor.close()
+
+def fetch_upstream_marker():
+    """Contents of tcgcsv's last-updated.txt, or None when it cannot be fetched"""
+    try:
+        response = etl_script.HTTP_SESSION.get(MARKER_URL, timeout=10)
+        response.raise_for_status()
+        return response.text.strip()
+    except Exception as e:
+        logging.error(f"Error fetching upstream marker: {e}")
+        return None
+
+def get_job_state(conn):
+    """(last completed marker, last status, last finish time) of every job"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT job_name, last_marker, last_status, last_finished_at FROM etl_job_state")
+        return {row[0]: row[1:] for row in cursor.fetchall()}
+    finally:
+        cursor.close()
+
+def record_job(conn, job_name, status, marker=None):
+    """Record a job start ('running') or its outcome; the marker only advances on success"""
+    cursor = conn.cursor()
+    try:
+        if status == "running":
+            cursor.execute("""
+                INSERT INTO etl_job_state (job_name, last_started_at, last_status)
+                VALUES (%s, now(), %s)
+                ON CONFLICT (job_name) DO UPDATE SET
+                    last_started_at = EXCLUDED.last_started_at,
+                    last_status = EXCLUDED.last_status
+            """, (job_name, status))
+        else:
+            cursor.execute("""
+                UPDATE etl_job_state
+                SET last_finished_at = now(),
+                    last_status = %s,
+                    last_marker = CASE WHEN %s = 'ok' THEN %s ELSE last_marker END
+                WHERE job_name = %s
+            """, (status, status, marker, job_name))
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logging.error(f"Error recording state of job '{job_name}': {e}")
+    finally:
+        cursor.close()
+
+def run_chain(conn, marker, force=False):
+    """Run every job of the chain that has not completed marker yet, in order.
+
+    Stops at the first job that fails or is locked by another instance, so
+    later jobs never run on stale inputs. A failed job is retried after
+    RETRY_SECONDS. Returns the number of jobs run.
+    """
+    state = {} if force else get_job_state(conn)
+    jobs_run = 0
+    for job_name, job in JOB_CHAIN:
+        last_marker, last_status, last_finished_at = state.get(job_name, (None, None, None))
+        if last_marker == marker:
+            continue
+        if last_status == "failed" and last_finished_at is not None \
+                and datetime.now() - last_finished_at < timedelta(seconds=RETRY_SECONDS):
+            logging.info(f"Job '{job_name}' failed recently, retrying after {RETRY_SECONDS} seconds")
+            return jobs_run
+
+        logging.info(f"Running job '{job_name}' for upstream update {marker}")
+        record_job(conn, job_name, "running")
+        start_time = datetime.now()
+        try:
+            result = run_locked(job_name, job)
+        except Exception as e:
+            logging.error(f"Job '{job_name}' raised: {e}")
+            result = False
+
+        if result is None:
+            record_job(conn, job_name, "locked")
+            return jobs_run
+
+        duration = (datetime.now() - start_time).total_seconds() / 60.0
+        status = "ok" if result else "failed"
+        record_job(conn, job_name, status, marker)
+        jobs_run += 1
+        logging.info(f"Job '{job_name}' {status} in {duration:.2f} minutes")
+        if not result:
+            return jobs_run
+
+    return jobs_run
+
+def main():
+    """Poll the upstream marker and run the ETL chain when it changes"""
+    parser = argparse.ArgumentParser(description="Run the ETL chain whenever tcgcsv publishes new data")
+    parser.add_argument("--once", action="store_true", help="check the marker once and exit (for cron)")
+    parser.add_argument("--force", action="store_true", help="run the whole chain even if the marker is unchanged")
+    parser.add_argument("--poll-seconds", type=int, default=POLL_SECONDS, help=f"seconds between checks (default: {POLL_SECONDS})")
+    args = parser.parse_args()
+
+    stop = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda signum, frame: stop.set())
+
+    logging.info(f"Starting ETL scheduler, polling every {args.poll_seconds} seconds")
+    conn = psycopg2.connect(**DB_PARAMS)
+    ensure_state_table(conn)
+    force = args.force
+
+    while not stop.is_set():
+        try:
+            if conn.closed:
+                conn = psycopg2.connect(**DB_PARAMS)
+            marker = fetch_upstream_marker()
+            if marker is not None:
+                jobs_run = run_chain(conn, marker, force)
+                force = False
+                if jobs_run == 0:
+                    logging.info(f"Upstream unchanged ({marker}), nothing to do")
+        except psycopg2.Error as e:
+            logging.error(f"Scheduler database error: {e}")
+            conn.close()
+        except Exception as e:
+            logging.error(f"Scheduler iteration failed: {e}")
+
+        if args.once:
+            break
+        # A job can take longer than the poll interval; wait() returns early on SIGTERM
+        stop.wait(args.poll_seconds)
+
+    conn.close()
+    logging.info("ETL scheduler stopped")
+
+if __name__ == "__main__":
+    main()
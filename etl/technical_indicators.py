@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+
+import psycopg2
+import numpy as np
+import pandas as pd
+import logging
+from datetime import date
+import os
+import time
+from dotenv import load_dotenv
+
+from history_frame import load_price_history, pivot_daily, copy_dataframe
+from price_validation import ensure_quarantine_table
+
+# Load environment variables
+load_dotenv()
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+    handlers=[
+        logging.FileHandler("technical_indicators.log"),
+        logging.StreamHandler()
+    ]
+)
+
+# Database connection parameters
+DB_PARAMS = {
+    "host": os.getenv("DB_HOST", "localhost"),
+    "database": os.getenv("DB_NAME", "pokemon_tcg"),
+    "user": os.getenv("DB_USER", "postgres"),
+    "password": os.getenv("DB_PASSWORD", ""),
+    "port": os.getenv("DB_PORT", "5432")
+}
+
+MOVING_AVERAGE_WINDOWS = [7, 30, 90]
+VOLATILITY_WINDOW = 30
+HIGH_LOW_WINDOW = 365  # 52 weeks
+
+INDICATOR_COLUMNS = [
+    "product_id", "sub_type_name", "as_of_date", "last_price_date", "current_price",
+    "sma_7", "sma_30", "sma_90", "ema_7", "ema_30", "ema_90",
+    "volatility_30d", "max_drawdown_pct", "high_52w", "low_52w"
+]
+
+def ensure_indicators_table(conn):
+    """Create the price_indicators table if it does not exist yet"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS price_indicators (
+                product_id        INTEGER      NOT NULL,
+                sub_type_name     VARCHAR(100) NOT NULL,
+                as_of_date        DATE         NOT NULL,
+                last_price_date   DATE         NOT NULL,
+                current_price     REAL,
+                sma_7             REAL,
+                sma_30            REAL,
+                sma_90            REAL,
+                ema_7             REAL,
+                ema_30            REAL,
+                ema_90            REAL,
+                volatility_30d    REAL,
+                max_drawdown_pct  REAL,
+                high_52w          REAL,
+                low_52w           REAL,
+                PRIMARY KEY (product_id, sub_type_name)
+            )
+        """)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logging.error(f"Error creating price_indicators table: {e}")
+        raise
+    finally:
+        cursor.close()
+
+def compute_indicators(wide, as_of):
+    """Compute every indicator for all variants at once from a (day x variant) matrix"""
+    if wide.empty:
+        return pd.DataFrame(columns=INDICATOR_COLUMNS)
+
+    # Last day each variant actually had a price, taken before the forward fill
+    # is applied so stale cards can be recognised by consumers
+    observed = wide.notna()
+    last_price_idx = observed.values[::-1].argmax(axis=0)
+    last_price_date = wide.index[len(wide.index) - 1 - last_price_idx]
+
+    filled = wide.ffill()
+    current = filled.iloc[-1]
+
+    result = pd.DataFrame({
+        "product_id": filled.columns.get_level_values(0),
+        "sub_type_name": filled.columns.get_level_values(1),
+        "as_of_date": as_of,
+        "last_price_date": last_price_date.date,
+        "current_price": current.values,
+    })
+
+    for window in MOVING_AVERAGE_WINDOWS:
+        # Only the latest value is stored, so a tail mean replaces a full rolling pass
+        result[f"sma_{window}"] = filled.iloc[-window:].mean().values
+        result[f"ema_{window}"] = filled.ewm(span=window, adjust=False).mean().iloc[-1].values
+
+    # Standard deviation of daily returns in percent over the last 30 days
+    returns = filled.iloc[-(VOLATILITY_WINDOW + 1):].pct_change(fill_method=None)
+    result["volatility_30d"] = (returns.std() * 100).values
+
+    # Deepest fall from a running peak over the whole history, in percent
+    drawdown = filled / filled.cummax() - 1
+    result["max_drawdown_pct"] = (drawdown.min() * 100).values
+
+    year = filled.iloc[-HIGH_LOW_WINDOW:]
+    result["high_52w"] = year.max().values
+    result["low_52w"] = year.min().values
+
+    # Variants with no price at all have nothing worth storing
+    result = result[current.notna().values]
+    return result.round(4)
+
+def store_indicators(conn, indicators):
+    """Replace the contents of price_indicators in one transaction"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("DELETE FROM price_indicators")
+        copied = copy_dataframe(cursor, indicators, "price_indicators", INDICATOR_COLUMNS)
+        conn.commit()
+        return copied
+    except Exception as e:
+        conn.rollback()
+        logging.error(f"Error storing indicators: {e}")
+        return 0
+    finally:
+        cursor.close()
+
+def main():
+    """Compute technical indicators for every product/sub-type in one vectorized pass"""
+    logging.info("Starting technical indicator calculation")
+    start_time = time.time()
+
+    try:
+        conn = psycopg2.connect(**DB_PARAMS)
+        ensure_indicators_table(conn)
+        ensure_quarantine_table(conn)  # load_price_history skips held rows
+        as_of = date.today()
+
+        load_start = time.time()
+        history = load_price_history(conn, columns=["market_price"], end_date=as_of)
+        logging.info(f"Loaded {len(history)} price rows in {time.time() - load_start:.2f} seconds")
+
+        wide = pivot_daily(history, "market_price", end_date=as_of, ffill_limit=0)
+        del history
+        logging.info(f"Built price matrix of {wide.shape[0]} days x {wide.shape[1]} variants")
+
+        compute_start = time.time()
+        indicators = compute_indicators(wide, as_of)
+        logging.info(f"Computed indicators in {time.time() - compute_start:.2f} seconds")
+
+        stored = store_indicators(conn, indicators)
+        conn.close()
+
+        duration = time.time() - start_time
+        logging.info(f"Technical indicator calculation completed in {duration:.2f} seconds, stored {stored} variants")
+
+    except Exception as e:
+        logging.error(f"Technical indicator calculation failed: {e}")
+
+if __name__ == "__main__":
+    main()
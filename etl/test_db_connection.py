@@ -1,5 +1,10 @@
 import psycopg2
+from psycopg2.extras import RealDictCursor
 import os
+import json
+import argparse
+from datetime import date, datetime, timedelta
+from decimal import Decimal
 from dotenv import load_dotenv
 import sys
 
@@ -15,6 +20,10 @@ DB_PARAMS = {
     "port": os.getenv("DB_PORT", "5432")
 }
 
+# Tables the nightly jobs read and write most
+DIAGNOSTIC_TABLES = ["price_history", "products", "price_change_variant"]
+EXPLAIN_BATCH_SIZE = 500  # Same batch size as price_changes.py
+
 def test_connection():
     """Test the database connection and display useful information"""
     print("\n===== DATABASE CONNECTION TEST =====\n")
@@ -105,6 +114,216 @@ def test_connection():
         print("\n===== TEST FAILED =====")
         return False
 
+def fetch_dicts(cursor, query, params=None):
+    """Run a query and return its rows as plain dicts"""
+    cursor.execute(query, params)
+    return [dict(row) for row in cursor.fetchall()]
+
+def get_table_stats(cursor):
+    """Sizes, live/dead tuples and vacuum history of the hot tables"""
+    return fetch_dicts(cursor, """
+        SELECT
+            c.relname AS table_name,
+            pg_total_relation_size(c.oid) AS total_bytes,
+            pg_relation_size(c.oid) AS table_bytes,
+            pg_indexes_size(c.oid) AS index_bytes,
+            s.n_live_tup AS live_tuples,
+            s.n_dead_tup AS dead_tuples,
+            ROUND(s.n_dead_tup::numeric / NULLIF(s.n_live_tup + s.n_dead_tup, 0) * 100, 2) AS dead_tuple_pct,
+            s.seq_scan, s.idx_scan,
+            s.last_vacuum, s.last_autovacuum, s.last_analyze, s.last_autoanalyze,
+            ROUND(st.heap_blks_hit::numeric / NULLIF(st.heap_blks_hit + st.heap_blks_read, 0) * 100, 2) AS heap_hit_pct
+        FROM pg_class c
+        JOIN pg_stat_user_tables s ON s.relid = c.oid
+        JOIN pg_statio_user_tables st ON st.relid = c.oid
+        WHERE c.relname = ANY(%s)
+        ORDER BY c.relname
+    """, (DIAGNOSTIC_TABLES,))
+
+def get_table_bloat(cursor):
+    """Estimate table bloat from page counts versus the space the live rows need"""
+    return fetch_dicts(cursor, """
+        SELECT
+            c.relname AS table_name,
+            c.relpages AS pages,
+            CEIL(c.reltuples * COALESCE(w.avg_row_bytes, 0)
+                 / (current_setting('block_size')::int - 24)) AS expected_pages,
+            ROUND(GREATEST(c.relpages - CEIL(c.reltuples * COALESCE(w.avg_row_bytes, 0)
+                 / (current_setting('block_size')::int - 24)), 0)::numeric
+                 / NULLIF(c.relpages, 0) * 100, 2) AS estimated_bloat_pct
+        FROM pg_class c
+        LEFT JOIN (
+            -- Average row width from column statistics plus the tuple header
+            SELECT tablename, SUM(avg_width) + 24 AS avg_row_bytes
+            FROM pg_stats
+            WHERE schemaname = 'public'
+            GROUP BY tablename
+        ) w ON w.tablename = c.relname
+        WHERE c.relname = ANY(%s)
+          AND c.relkind = 'r'
+        ORDER BY c.relname
+    """, (DIAGNOSTIC_TABLES,))
+
+def get_index_stats(cursor):
+    """Size, scans and buffer hit rate of every index on the hot tables"""
+    return fetch_dicts(cursor, """
+        SELECT
+            s.relname AS table_name,
+            s.indexrelname AS index_name,
+            pg_relation_size(s.indexrelid) AS index_bytes,
+            s.idx_scan,
+            s.idx_tup_read,
+            ROUND(io.idx_blks_hit::numeric / NULLIF(io.idx_blks_hit + io.idx_blks_read, 0) * 100, 2) AS hit_pct,
+            i.indisunique AS is_unique
+        FROM pg_stat_user_indexes s
+        JOIN pg_statio_user_indexes io ON io.indexrelid = s.indexrelid
+        JOIN pg_index i ON i.indexrelid = s.indexrelid
+        WHERE s.relname = ANY(%s)
+        ORDER BY s.relname, s.indexrelname
+    """, (DIAGNOSTIC_TABLES,))
+
+def get_unused_indexes(index_stats):
+    """Indexes that were never scanned and do not enforce uniqueness"""
+    return [
+        {"table_name": idx["table_name"], "index_name": idx["index_name"], "index_bytes": idx["index_bytes"]}
+        for idx in index_stats
+        if idx["idx_scan"] == 0 and not idx["is_unique"]
+    ]
+
+def explain(cursor, query, params, analyze=True):
+    """EXPLAIN a query inside a transaction that is rolled back.
+
+    With analyze the query really runs (EXPLAIN ANALYZE, BUFFERS) and its
+    timings are reported; write statements are only planned, since running
+    them would take the row locks a concurrent job needs.
+    """
+    cursor.execute("SAVEPOINT diagnostics_explain")
+    try:
+        options = "ANALYZE, BUFFERS, FORMAT JSON" if analyze else "FORMAT JSON"
+        cursor.execute(f"EXPLAIN ({options}) " + query, params)
+        plan = cursor.fetchone()
+        plan = plan["QUERY PLAN"] if isinstance(plan, dict) else plan[0]
+        return plan[0] if isinstance(plan, list) else plan
+    except Exception as e:
+        return {"error": str(e)}
+    finally:
+        # Never keep anything an analyzed query wrote
+        cursor.execute("ROLLBACK TO SAVEPOINT diagnostics_explain")
+
+def get_hot_query_plans(cursor):
+    """Plans of the queries price_changes.py runs for every batch and at the end of a run"""
+    from price_change_queries import (
+        SNAPSHOT_PRICES_QUERY, build_leaderboard_query, is_valid_timeframe,
+        LEADERBOARD_MIN_PRICE, LEADERBOARD_SIZE, LEADERBOARD_TIMEFRAMES, LEADERBOARD_ALL_SUB_TYPES,
+    )
+    from price_storage import AS_OF_PRICES_QUERY
+
+    cursor.execute("SELECT product_id FROM products ORDER BY product_id LIMIT %s", (EXPLAIN_BATCH_SIZE,))
+    product_ids = [row["product_id"] for row in cursor.fetchall()]
+    today = date.today()
+    timeframes = [timeframe for timeframe in LEADERBOARD_TIMEFRAMES if is_valid_timeframe(timeframe)]
+
+    plans = {
+        "snapshot_prices": explain(cursor, SNAPSHOT_PRICES_QUERY, (product_ids,)),
+        "as_of_prices_7d": explain(cursor, AS_OF_PRICES_QUERY, (product_ids, today - timedelta(days=7))),
+        "as_of_prices_1y": explain(cursor, AS_OF_PRICES_QUERY, (product_ids, today - timedelta(days=365))),
+        # Planned only: running the refresh INSERT needs the DELETE before it,
+        # which would lock the table under a concurrent refresh
+        "leaderboard_refresh": explain(cursor, build_leaderboard_query(timeframes), {
+            "min_price": LEADERBOARD_MIN_PRICE, "size": LEADERBOARD_SIZE, "all_sub_types": LEADERBOARD_ALL_SUB_TYPES
+        }, analyze=False),
+    }
+    for name, plan in plans.items():
+        if "error" not in plan:
+            # Keep the headline numbers next to the full plan for easy tracking
+            plan["summary"] = {
+                "estimated_cost": plan["Plan"].get("Total Cost"),
+                "execution_ms": plan.get("Execution Time"),
+                "planning_ms": plan.get("Planning Time"),
+                "shared_hit_blocks": plan["Plan"].get("Shared Hit Blocks"),
+                "shared_read_blocks": plan["Plan"].get("Shared Read Blocks"),
+            }
+    return {"batch_size": len(product_ids), "plans": plans}
+
+def get_top_statements(cursor, limit=20):
+    """Top statements by total time from pg_stat_statements, or None if it is not installed"""
+    cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_stat_statements'")
+    if not cursor.fetchone():
+        return None
+
+    # PostgreSQL 13 renamed total_time/mean_time to total_exec_time/mean_exec_time
+    cursor.execute("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_name = 'pg_stat_statements' AND column_name = 'total_exec_time'
+    """)
+    time_column = "total_exec_time" if cursor.fetchone() else "total_time"
+    mean_column = "mean_exec_time" if time_column == "total_exec_time" else "mean_time"
+
+    try:
+        return fetch_dicts(cursor, f"""
+            SELECT
+                LEFT(query, 500) AS query,
+                calls,
+                ROUND({time_column}::numeric, 2) AS total_ms,
+                ROUND({mean_column}::numeric, 2) AS mean_ms,
+                rows,
+                shared_blks_hit,
+                shared_blks_read
+            FROM pg_stat_statements
+            WHERE dbid = (SELECT oid FROM pg_database WHERE datname = current_database())
+            ORDER BY {time_column} DESC
+            LIMIT %s
+        """, (limit,))
+    except Exception as e:
+        return {"error": str(e)}
+
+def json_default(value):
+    """Serialize the date and numeric types psycopg2 returns"""
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    return str(value)
+
+def run_diagnostics(output=None, explain_queries=True):
+    """Collect database performance diagnostics and write them as JSON"""
+    conn = psycopg2.connect(**DB_PARAMS)
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    try:
+        index_stats = get_index_stats(cursor)
+        report = {
+            "collected_at": datetime.now(),
+            "database": DB_PARAMS["database"],
+            "tables": get_table_stats(cursor),
+            "bloat": get_table_bloat(cursor),
+            "indexes": index_stats,
+            "unused_indexes": get_unused_indexes(index_stats),
+            "hot_queries": get_hot_query_plans(cursor) if explain_queries else None,
+            "top_statements": get_top_statements(cursor),
+        }
+    finally:
+        conn.rollback()
+        cursor.close()
+        conn.close()
+
+    text = json.dumps(report, default=json_default, indent=2)
+    if output:
+        with open(output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+    return report
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Test the database connection or collect performance diagnostics")
+    parser.add_argument("--diagnostics", action="store_true", help="print a JSON performance report instead of the connection test")
+    parser.add_argument("--no-explain", action="store_true", help="skip EXPLAIN ANALYZE of the hot ETL queries")
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    args = parser.parse_args()
+
+    if args.diagnostics:
+        run_diagnostics(args.output, explain_queries=not args.no_explain)
+        sys.exit(0)
+
     successful = test_connection()
     sys.exit(0 if successful else 1)
\ No newline at end of file
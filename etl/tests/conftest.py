@@ -0,0 +1,10 @@
+import os
+import sys
+import tempfile
+
+# The ETL scripts import each other by module name, as when run from etl/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# They also open their log files in the working directory at import time;
+# keep those out of the checkout
+os.chdir(tempfile.mkdtemp(prefix="etl-tests-"))
@@ -0,0 +1,84 @@
+import pandas as pd
+
+import etl_script
+
+
+class FakeCursor:
+    def close(self):
+        pass
+
+
+class FakeConn:
+    def cursor(self):
+        return FakeCursor()
+
+
+class FakeBatcher:
+    def __init__(self):
+        self.failed_groups = []
+        self.rows = None
+
+    def begin_group(self):
+        pass
+
+    def end_group(self, rows):
+        self.rows = rows
+
+    def fail_group(self, group_id):
+        self.failed_groups.append(group_id)
+
+
+def test_product_with_two_sub_types_is_upserted_once(monkeypatch):
+    upserts = []
+    inserted_prices = []
+
+    def fake_execute_values(cursor, query, values, **kwargs):
+        upserts.append(values)
+
+    def fake_insert_prices(cursor, group_id, date_val, prices):
+        inserted_prices.extend(prices)
+        return [(p[0], p[1], date_val, p[5]) for p in prices]
+
+    monkeypatch.setattr(etl_script, "execute_values", fake_execute_values)
+    monkeypatch.setattr(etl_script, "screen_prices", lambda cursor, group_id, date_val, prices: (prices, set()))
+    monkeypatch.setattr(etl_script, "insert_prices", fake_insert_prices)
+    monkeypatch.setattr(etl_script, "update_price_snapshot", lambda cursor, rows: len(rows))
+
+    df = pd.DataFrame([
+        {"productId": 42, "name": "Pikachu", "subTypeName": "Normal",
+         "marketPrice": 1.5, "directLowPrice": None, "lowPrice": 1.0, "midPrice": 1.4, "highPrice": 3.0},
+        {"productId": 42, "name": "Pikachu", "subTypeName": "Holofoil",
+         "marketPrice": 4.0, "directLowPrice": None, "lowPrice": 3.0, "midPrice": 3.8, "highPrice": 9.0},
+        {"productId": 43, "name": "Raichu", "subTypeName": "Normal",
+         "marketPrice": 2.0, "directLowPrice": None, "lowPrice": 1.5, "midPrice": 1.9, "highPrice": 4.0},
+    ])
+    batcher = FakeBatcher()
+
+    etl_script.update_products_and_prices(FakeConn(), df, group_id=1, category_id=3, batcher=batcher)
+
+    assert batcher.failed_groups == []
+    assert len(upserts) == 1
+    product_ids = [values[0] for values in upserts[0]]
+    assert sorted(product_ids) == [42, 43]
+    # The last sub-type listed for a product is the one kept on its products row
+    assert {values[0]: values[8] for values in upserts[0]}[42] == "Holofoil"
+    # Prices are still recorded per sub-type
+    assert {(p[0], p[1]) for p in inserted_prices} == {(42, "Normal"), (42, "Holofoil"), (43, "Normal")}
+
+
+def test_commit_every_defaults_follow_the_mode():
+    assert etl_script.TransactionBatcher(FakeConn(), mode="groups", every=None).every == 10
+    assert etl_script.TransactionBatcher(FakeConn(), mode="rows", every=None).every == 5000
+    assert etl_script.TransactionBatcher(FakeConn(), mode="rows", every=200).every == 200
+
+
+def test_update_groups_writes_inside_the_batcher(monkeypatch):
+    monkeypatch.setattr(etl_script, "execute_batch", lambda cursor, query, values: None)
+    batcher = FakeBatcher()
+
+    etl_script.update_groups(FakeConn(), [{"groupId": 1, "groupName": "Base Set", "publishedOn": "1999-01-09T00:00:00"}],
+                             category_id=3, batcher=batcher)
+
+    # FakeConn has no commit(): the write is left to the batcher
+    assert batcher.rows == 1
+    assert batcher.failed_groups == []
@@ -0,0 +1,106 @@
+"""As-of reads against a real Postgres; skipped when none is reachable.
+
+Uses the DB_* settings of the ETL and works in a throwaway schema.
+"""
+
+import os
+from datetime import date, timedelta
+
+import psycopg2
+import pytest
+
+import compact_price_history
+from price_storage import get_prices_as_of, insert_prices
+from price_validation import ensure_quarantine_table
+
+SCHEMA = f"etl_test_{os.getpid()}"
+START = date(2024, 3, 1)
+# Daily market prices of one variant with repeats, a gap (None = not listed)
+# and a held spike on day 7
+PRICES = [1.00, 1.00, 1.00, 1.25, 1.25, None, 9.99, 1.25, 1.10, 1.10]
+SPIKE_DAY = 6
+
+
+@pytest.fixture
+def conn():
+    try:
+        conn = psycopg2.connect(connect_timeout=3, **compact_price_history.DB_PARAMS)
+    except psycopg2.OperationalError as e:
+        pytest.skip(f"No database available: {e}")
+    cursor = conn.cursor()
+    cursor.execute(f"CREATE SCHEMA {SCHEMA}")
+    cursor.execute(f"SET search_path TO {SCHEMA}")
+    cursor.execute("""
+        CREATE TABLE price_history (
+            id                SERIAL PRIMARY KEY,
+            product_id        INTEGER       NOT NULL,
+            group_id          INTEGER       NOT NULL,
+            sub_type_name     VARCHAR(100)  NOT NULL DEFAULT '',
+            date_point        DATE          NOT NULL,
+            period_type       VARCHAR(10)   NOT NULL,
+            end_date          DATE,
+            open_price        DECIMAL(10,2),
+            close_price       DECIMAL(10,2),
+            low_price         DECIMAL(10,2),
+            high_price        DECIMAL(10,2),
+            mid_price         DECIMAL(10,2),
+            market_price      DECIMAL(10,2),
+            direct_low_price  DECIMAL(10,2),
+            volume            INTEGER,
+            UNIQUE (product_id, sub_type_name, date_point, period_type)
+        )
+    """)
+    conn.commit()
+    ensure_quarantine_table(conn)
+    cursor.close()
+    yield conn
+    conn.rollback()
+    cursor = conn.cursor()
+    cursor.execute(f"DROP SCHEMA {SCHEMA} CASCADE")
+    conn.commit()
+    conn.close()
+
+
+def as_of_all_days(conn):
+    cursor = conn.cursor()
+    try:
+        return [
+            get_prices_as_of(cursor, [1], START + timedelta(days=day))
+            for day in range(len(PRICES) + 2)
+        ]
+    finally:
+        cursor.close()
+
+
+def prices_of(answers):
+    return [[row[:3] for row in rows] for rows in answers]
+
+
+def days_of(offsets):
+    return [START + timedelta(days=offset) for offset in offsets]
+
+
+def test_as_of_reads_are_unchanged_by_compaction(conn):
+    cursor = conn.cursor()
+    for day, price in enumerate(PRICES):
+        if price is not None:
+            insert_prices(cursor, 10, START + timedelta(days=day), [(1, "Normal", None, None, None, price, None)], mode="full")
+    cursor.execute("""
+        INSERT INTO price_quarantine (product_id, sub_type_name, date_point, group_id, reasons, rejected, held, market_price)
+        VALUES (1, 'Normal', %s, 10, 'spike', FALSE, TRUE, 9.99)
+    """, (START + timedelta(days=SPIKE_DAY),))
+    conn.commit()
+    cursor.close()
+
+    before = as_of_all_days(conn)
+    removed = compact_price_history.compact_product_range(conn, 1, 1)
+    after = as_of_all_days(conn)
+
+    # Days 1, 2, 4, 7 and 9 repeat the row before them; the held spike on day 6 is skipped
+    assert removed == 5
+    assert prices_of(after) == prices_of(before)
+    # The held spike is never the price in effect
+    assert [rows[0][2] for rows in before[SPIKE_DAY:SPIKE_DAY + 2]] == [1.25, 1.25]
+    # Each answer reports the date of the row it came from, which compaction moves back
+    assert [rows[0][3] for rows in before] == days_of([0, 1, 2, 3, 4, 4, 4, 7, 8, 9, 9, 9])
+    assert [rows[0][3] for rows in after] == days_of([0, 0, 0, 3, 3, 3, 3, 3, 8, 8, 8, 8])
@@ -0,0 +1,86 @@
+import datetime
+
+import numpy as np
+
+import price_validation
+
+
+class BaselineCursor:
+    """Serves BASELINE_QUERY rows: (1-based record position, row age in days, market price)"""
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def execute(self, query, params):
+        pass
+
+    def fetchall(self):
+        return self.rows
+
+
+def screen(monkeypatch, prices, baseline_rows=()):
+    quarantined = []
+    monkeypatch.setattr(price_validation, "quarantine_prices",
+                        lambda cursor, group_id, date_val, rows: quarantined.extend(rows))
+    accepted, held = price_validation.screen_prices(
+        BaselineCursor(list(baseline_rows)), 1, datetime.date(2025, 1, 10), prices
+    )
+    return accepted, held, quarantined
+
+
+def test_clean_records_pass_untouched(monkeypatch):
+    prices = [(1, "Normal", 1.0, 3.0, 1.5, 1.4, None)]
+    accepted, held, quarantined = screen(monkeypatch, prices)
+    assert accepted == prices
+    assert held == set()
+    assert quarantined == []
+
+
+def test_only_the_invalid_field_is_dropped(monkeypatch):
+    prices = [(1, "Normal", -1.0, 3.0, 1.5, 1.4, None)]
+    accepted, held, quarantined = screen(monkeypatch, prices)
+    assert accepted == [(1, "Normal", None, 3.0, 1.5, 1.4, None)]
+    assert held == set()
+    (row,) = quarantined
+    assert row[2] == "invalid"
+    assert row[3] is False  # not rejected
+    assert row[4] is False  # not held out of the readers
+    assert row[5] == -1.0   # the original value is kept for review
+
+
+def test_record_without_valid_field_is_rejected(monkeypatch):
+    prices = [(1, "Normal", None, None, None, float("inf"), None), (2, "Normal", None, None, None, "abc", None)]
+    accepted, held, quarantined = screen(monkeypatch, prices)
+    assert accepted == []
+    assert [row[3] for row in quarantined] == [True, True]
+
+
+def test_inversion_and_spike_are_inserted_but_held(monkeypatch):
+    prices = [
+        (1, "Normal", 5.0, 1.0, 3.0, 2.0, None),
+        (2, "Normal", None, None, None, 50.0, None),
+        (3, "Normal", None, None, None, 10.3, None),
+    ]
+    baseline = [(ord_, rn, price) for ord_, price in ((2, 10.0), (3, 10.0)) for rn in range(1, 8)]
+    accepted, held, quarantined = screen(monkeypatch, prices, baseline)
+    assert accepted == prices
+    assert held == {(1, "Normal"), (2, "Normal")}
+    assert {row[0]: row[2] for row in quarantined} == {1: "inverted", 2: "spike"}
+    assert all(row[4] for row in quarantined)
+
+
+def test_change_only_baseline_is_filled_per_day(monkeypatch):
+    # A single change row from before the window is in effect on every day of it
+    prices = [(1, "Normal", None, None, None, 50.0, None), (2, "Normal", None, None, None, 50.0, None)]
+    baseline = [(1, 40, 10.0), (2, 3, 10.0)]
+    accepted, held, quarantined = screen(monkeypatch, prices, baseline)
+    assert accepted == prices
+    # Variant 2 has only three days with a price in effect, too few to check
+    assert held == {(1, "Normal")}
+    assert [(row[0], row[-1]) for row in quarantined] == [(1, 10.0)]
+
+
+def test_row_median_matches_nanmedian():
+    values = np.array([[3.0, 1.0, np.nan, 2.0], [4.0, np.nan, np.nan, 1.0], [5.0, 6.0, 7.0, 8.0]])
+    counts = np.count_nonzero(~np.isnan(values), axis=1)
+    assert np.allclose(price_validation.row_median(values, counts), np.nanmedian(values, axis=1))